@@ -0,0 +1,37 @@
+"""Create upcoming runs
+
+Revision ID: 0c7e4a2b95d1
+Revises: f6b1d9a3e270
+Create Date: 2026-10-18 17:56:08.331690
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0c7e4a2b95d1'
+down_revision: Union[str, Sequence[str], None] = 'f6b1d9a3e270'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'upcoming_runs',
+        sa.Column('schedule_id', sa.Integer(), primary_key=True),
+        sa.Column('bucket_start', sa.TIMESTAMP(timezone=True), primary_key=True),
+        sa.Column('server_id', sa.Integer(), nullable=False),
+        sa.Column('runs', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['schedule_id'], ['schedule_jobs.id'], ondelete='CASCADE'),
+    )
+    op.create_index('ix_upcoming_runs_bucket_start', 'upcoming_runs', ['bucket_start'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_upcoming_runs_bucket_start', table_name='upcoming_runs')
+    op.drop_table('upcoming_runs')
@@ -0,0 +1,34 @@
+"""Add job lane and queue wait
+
+Revision ID: 3e9a5c1f7b64
+Revises: 0c7e4a2b95d1
+Create Date: 2026-10-18 19:04:26.917302
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3e9a5c1f7b64'
+down_revision: Union[str, Sequence[str], None] = '0c7e4a2b95d1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('jobs', sa.Column('lane', sa.String(), nullable=True))
+    op.add_column('jobs', sa.Column('started_at', sa.TIMESTAMP(timezone=True), nullable=True))
+    op.add_column('jobs', sa.Column('queue_wait', sa.Float(), nullable=True))
+    op.create_index('ix_jobs_started_at', 'jobs', ['started_at'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_jobs_started_at', table_name='jobs')
+    op.drop_column('jobs', 'queue_wait')
+    op.drop_column('jobs', 'started_at')
+    op.drop_column('jobs', 'lane')
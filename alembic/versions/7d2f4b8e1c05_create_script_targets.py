@@ -0,0 +1,41 @@
+"""Create script targets
+
+Revision ID: 7d2f4b8e1c05
+Revises: c3e1a9d4b7f2
+Create Date: 2026-10-18 11:03:17.884120
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d2f4b8e1c05'
+down_revision: Union[str, Sequence[str], None] = 'c3e1a9d4b7f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'script_targets',
+        sa.Column('id', sa.Integer(), primary_key=True, index=True),
+        sa.Column('script_id', sa.Integer(), nullable=False),
+        sa.Column('server_id', sa.Integer(), nullable=False),
+        sa.Column('upload_status', sa.String(), nullable=False),
+        sa.Column('checksum', sa.String(length=64), nullable=True),
+        sa.Column('bytes_sent', sa.Integer(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('updated_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()')),
+        sa.ForeignKeyConstraint(['script_id'], ['scripts.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['server_id'], ['servers.id'], ondelete='CASCADE'),
+        sa.UniqueConstraint('script_id', 'server_id', name='unique_target_per_script')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('script_targets')
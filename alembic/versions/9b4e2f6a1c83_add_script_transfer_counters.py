@@ -0,0 +1,32 @@
+"""Add script transfer counters
+
+Revision ID: 9b4e2f6a1c83
+Revises: 3e9a5c1f7b64
+Create Date: 2026-10-18 20:12:41.503118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b4e2f6a1c83'
+down_revision: Union[str, Sequence[str], None] = '3e9a5c1f7b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('scripts', sa.Column('bytes_sent', sa.Integer(), nullable=True))
+    op.add_column('scripts', sa.Column('bytes_saved', sa.Integer(), nullable=True))
+    op.add_column('scripts', sa.Column('transfers_skipped', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('scripts', 'transfers_skipped')
+    op.drop_column('scripts', 'bytes_saved')
+    op.drop_column('scripts', 'bytes_sent')
@@ -0,0 +1,33 @@
+"""Create scheduler members
+
+Revision ID: a41f6e2d9b83
+Revises: e8b05c3a6d19
+Create Date: 2026-10-18 15:20:54.672031
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41f6e2d9b83'
+down_revision: Union[str, Sequence[str], None] = 'e8b05c3a6d19'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'scheduler_members',
+        sa.Column('instance_id', sa.String(), primary_key=True),
+        sa.Column('heartbeat_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.Column('started_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()')),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('scheduler_members')
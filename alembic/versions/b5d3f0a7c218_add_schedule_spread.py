@@ -0,0 +1,28 @@
+"""Add schedule spread
+
+Revision ID: b5d3f0a7c218
+Revises: a41f6e2d9b83
+Create Date: 2026-10-18 16:02:11.408375
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5d3f0a7c218'
+down_revision: Union[str, Sequence[str], None] = 'a41f6e2d9b83'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('schedule_jobs', sa.Column('spread_seconds', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('schedule_jobs', 'spread_seconds')
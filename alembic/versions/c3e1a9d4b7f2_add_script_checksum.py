@@ -0,0 +1,29 @@
+"""Add script checksum
+
+Revision ID: c3e1a9d4b7f2
+Revises: 5bac291e37a6
+Create Date: 2026-10-18 10:12:41.503218
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3e1a9d4b7f2'
+down_revision: Union[str, Sequence[str], None] = '5bac291e37a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('scripts',
+                  sa.Column('checksum', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('scripts', 'checksum')
@@ -0,0 +1,30 @@
+"""Add schedule misfire policy
+
+Revision ID: d2a8c6e4f917
+Revises: b5d3f0a7c218
+Create Date: 2026-10-18 16:41:37.120954
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2a8c6e4f917'
+down_revision: Union[str, Sequence[str], None] = 'b5d3f0a7c218'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('schedule_jobs', sa.Column('misfire_policy', sa.String(), nullable=True))
+    op.add_column('schedule_jobs', sa.Column('misfire_limit', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('schedule_jobs', 'misfire_limit')
+    op.drop_column('schedule_jobs', 'misfire_policy')
@@ -0,0 +1,149 @@
+"""Compress job outputs into deduplicated blobs
+
+Revision ID: e8b05c3a6d19
+Revises: 7d2f4b8e1c05
+Create Date: 2026-10-18 12:41:09.117352
+
+"""
+from typing import Sequence, Union
+import hashlib
+import zlib
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e8b05c3a6d19'
+down_revision: Union[str, Sequence[str], None] = '7d2f4b8e1c05'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 1000
+
+job_outputs = sa.table(
+    'job_outputs',
+    sa.column('id', sa.Integer),
+    sa.column('stdout', sa.Text),
+    sa.column('stderr', sa.Text),
+    sa.column('stdout_blob_id', sa.Integer),
+    sa.column('stderr_blob_id', sa.Integer),
+)
+output_blobs = sa.table(
+    'output_blobs',
+    sa.column('id', sa.Integer),
+    sa.column('sha256', sa.String),
+    sa.column('codec', sa.String),
+    sa.column('size', sa.Integer),
+    sa.column('data', sa.LargeBinary),
+)
+
+
+def _blob_ids(conn, texts):
+    """Map each text's sha256 to its blob id, inserting the blobs that don't exist yet."""
+    raws = {hashlib.sha256(raw).hexdigest(): raw for raw in (text.encode('utf-8') for text in texts if text)}
+    if not raws:
+        return {}
+    select = sa.select(output_blobs.c.sha256, output_blobs.c.id).where(output_blobs.c.sha256.in_(list(raws)))
+    ids = dict(conn.execute(select).all())
+    missing = [digest for digest in raws if digest not in ids]
+    if missing:
+        conn.execute(output_blobs.insert(), [
+            {'sha256': digest, 'codec': 'zlib', 'size': len(raws[digest]), 'data': zlib.compress(raws[digest], 6)}
+            for digest in missing
+        ])
+        ids.update(conn.execute(select).all())
+    return ids
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest() if text else None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'output_blobs',
+        sa.Column('id', sa.Integer(), primary_key=True, index=True),
+        sa.Column('sha256', sa.String(length=64), nullable=False, unique=True),
+        sa.Column('codec', sa.String(), nullable=False),
+        sa.Column('size', sa.Integer(), nullable=False),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('created_at', sa.TIMESTAMP(timezone=True), server_default=sa.text('now()')),
+    )
+    op.add_column('job_outputs', sa.Column('stdout_blob_id', sa.Integer(), sa.ForeignKey('output_blobs.id'), nullable=True))
+    op.add_column('job_outputs', sa.Column('stderr_blob_id', sa.Integer(), sa.ForeignKey('output_blobs.id'), nullable=True))
+
+    # Move existing text into blobs in batches so large tables don't need it all in memory
+    conn = op.get_bind()
+    update = (
+        job_outputs.update()
+        .where(job_outputs.c.id == sa.bindparam('row_id'))
+        .values(
+            stdout_blob_id=sa.bindparam('stdout_id'),
+            stderr_blob_id=sa.bindparam('stderr_id'),
+            stdout=None,
+            stderr=None,
+        )
+    )
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(job_outputs.c.id, job_outputs.c.stdout, job_outputs.c.stderr)
+            .where(job_outputs.c.id > last_id)
+            .where(sa.or_(job_outputs.c.stdout.isnot(None), job_outputs.c.stderr.isnot(None)))
+            .order_by(job_outputs.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        ids = _blob_ids(conn, [text for row in rows for text in (row.stdout, row.stderr)])
+        conn.execute(update, [
+            {
+                'row_id': row.id,
+                'stdout_id': ids.get(_digest(row.stdout)),
+                'stderr_id': ids.get(_digest(row.stderr)),
+            }
+            for row in rows
+        ])
+        last_id = rows[-1].id
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    conn = op.get_bind()
+    stdout_blobs = output_blobs.alias('stdout_blobs')
+    stderr_blobs = output_blobs.alias('stderr_blobs')
+    update = (
+        job_outputs.update()
+        .where(job_outputs.c.id == sa.bindparam('row_id'))
+        .values(stdout=sa.bindparam('stdout_text'), stderr=sa.bindparam('stderr_text'))
+    )
+
+    # Same keyset batches as the upgrade so the whole table is never loaded at once
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(job_outputs.c.id, stdout_blobs.c.data.label('stdout'), stderr_blobs.c.data.label('stderr'))
+            .outerjoin(stdout_blobs, stdout_blobs.c.id == job_outputs.c.stdout_blob_id)
+            .outerjoin(stderr_blobs, stderr_blobs.c.id == job_outputs.c.stderr_blob_id)
+            .where(job_outputs.c.id > last_id)
+            .where(sa.or_(job_outputs.c.stdout_blob_id.isnot(None), job_outputs.c.stderr_blob_id.isnot(None)))
+            .order_by(job_outputs.c.id)
+            .limit(BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        conn.execute(update, [
+            {
+                'row_id': row.id,
+                'stdout_text': zlib.decompress(row.stdout).decode('utf-8') if row.stdout is not None else None,
+                'stderr_text': zlib.decompress(row.stderr).decode('utf-8') if row.stderr is not None else None,
+            }
+            for row in rows
+        ])
+        last_id = rows[-1].id
+
+    op.drop_column('job_outputs', 'stderr_blob_id')
+    op.drop_column('job_outputs', 'stdout_blob_id')
+    op.drop_table('output_blobs')
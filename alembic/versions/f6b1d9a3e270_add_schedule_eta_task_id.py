@@ -0,0 +1,28 @@
+"""Add schedule eta task id
+
+Revision ID: f6b1d9a3e270
+Revises: d2a8c6e4f917
+Create Date: 2026-10-18 17:18:52.603417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f6b1d9a3e270'
+down_revision: Union[str, Sequence[str], None] = 'd2a8c6e4f917'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('schedule_jobs', sa.Column('eta_task_id', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('schedule_jobs', 'eta_task_id')
@@ -1,9 +1,19 @@
 from celery import Celery
+from celery.signals import worker_process_init
+from config import settings
+from db_stuffs.database import init_worker_engine
+
+# Priority lanes: operators' manual runs, schedule fires, and bulk work
+# (fan-outs, missed-run replays, uploads). Each lane is its own queue.
+INTERACTIVE_LANE = "interactive"
+SCHEDULED_LANE = "scheduled"
+BULK_LANE = "bulk"
+LANES = (INTERACTIVE_LANE, SCHEDULED_LANE, BULK_LANE)
 
 celery_app = Celery(
     "worker",
-    broker="redis://localhost:6379/0",
-    backend="redis://localhost:6379/0",
+    broker=settings.REDIS_URL,
+    backend=settings.REDIS_URL,
     include=["tasks"]  # Import tasks module to discover tasks
 )
 
@@ -13,7 +23,25 @@ celery_app.conf.update(
     accept_content=['json'],
     timezone='Asia/Kolkata',
     enable_utc=True,
+    result_expires=settings.CELERY_RESULT_EXPIRES,
+    task_default_queue=SCHEDULED_LANE,
+    task_routes={
+        "tasks.upload_script": {"queue": BULK_LANE},
+        "tasks.publish_script": {"queue": BULK_LANE},
+    },
+    # A worker consuming several lanes always drains them in its -Q order,
+    # so `-Q interactive,scheduled,bulk` serves interactive runs first
+    broker_transport_options={"queue_order_strategy": "priority"},
+    # Take one task at a time so tasks deferred by the per-host limits
+    # aren't hoarded by a single busy worker
+    worker_prefetch_multiplier=1,
 )
 
 # Import tasks so Celery discovers them
 #from task import execute_script_task  # ✅ Required!
+
+
+@worker_process_init.connect
+def _init_worker_process(**kwargs):
+    # Prefork children must not share the parent's DB connections
+    init_worker_engine()
@@ -0,0 +1,148 @@
+import time
+
+from paramiko.ssh_exception import AuthenticationException
+
+from config import settings
+from logger import logger
+from redis_client import redis_client
+
+
+# Count a failure; the window starts with the first one, even if a caller died mid-way before
+RECORD_FAILURE_SCRIPT = """
+local failures = redis.call('INCR', KEYS[1])
+if redis.call('TTL', KEYS[1]) < 0 then
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[1]))
+end
+return failures
+"""
+
+
+class CircuitOpenError(ConnectionError):
+    pass
+
+
+class CircuitBreaker:
+    """Per-host circuit breaker whose state lives in Redis.
+
+    After `threshold` connection failures within `window` seconds the circuit
+    opens and every caller, in the API or any Celery worker, fails fast for
+    `cooldown` seconds. Then a single half-open probe is let through: success
+    closes the circuit, failure opens it again. If Redis is unreachable the
+    breaker stays out of the way.
+    """
+
+    def __init__(self, client, threshold: int, window: int, cooldown: int, prefix: str = "orchkid:circuit"):
+        self.client = client
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+        self.prefix = prefix
+        self._count_failure = client.register_script(RECORD_FAILURE_SCRIPT)
+
+    def _key(self, hostname: str, port: int, suffix: str = ""):
+        key = f"{self.prefix}:{hostname}:{port or 22}"
+        return f"{key}:{suffix}" if suffix else key
+
+    def before_call(self, hostname: str, port: int = 22, probe_timeout: int = 30):
+        try:
+            info = self.client.hgetall(self._key(hostname, port))
+            if info.get("state", "closed") == "closed":
+                return
+            if self.client.exists(self._key(hostname, port, "open")):
+                raise CircuitOpenError(f"Circuit open for {hostname}: {info.get('last_error', 'recent failures')}")
+            # Cooldown over: exactly one caller gets to probe the host
+            if not self.client.set(self._key(hostname, port, "probe"), "1", nx=True, ex=probe_timeout):
+                raise CircuitOpenError(f"Circuit half-open for {hostname}, probe in progress")
+            self.client.hset(self._key(hostname, port), "state", "half_open")
+            logger.info(f"Circuit for {hostname} half-open, probing")
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.warning(f"Circuit breaker unavailable, allowing {hostname}: {e}")
+
+    def record_success(self, hostname: str, port: int = 22):
+        try:
+            key = self._key(hostname, port)
+            if self.client.hget(key, "state") not in (None, "closed"):
+                logger.info(f"Circuit for {hostname} closed")
+            pipe = self.client.pipeline()
+            pipe.hset(key, mapping={"state": "closed", "last_success_at": time.time()})
+            pipe.delete(self._key(hostname, port, "failures"), self._key(hostname, port, "open"), self._key(hostname, port, "probe"))
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Circuit breaker unavailable, could not record success for {hostname}: {e}")
+
+    def record_failure(self, hostname: str, port: int, error: Exception):
+        try:
+            key = self._key(hostname, port)
+            failures_key = self._key(hostname, port, "failures")
+            failures = self._count_failure(keys=[failures_key], args=[self.window])
+            state = self.client.hget(key, "state")
+
+            self.client.hset(key, mapping={"last_error": str(error)[:500], "last_failure_at": time.time(), "failures": failures})
+            if failures >= self.threshold or state == "half_open":
+                pipe = self.client.pipeline()
+                pipe.set(self._key(hostname, port, "open"), "1", ex=self.cooldown)
+                pipe.hset(key, "state", "open")
+                pipe.delete(self._key(hostname, port, "probe"))
+                pipe.execute()
+                logger.warning(f"Circuit for {hostname} opened after {failures} failures: {error}")
+        except Exception as e:
+            logger.warning(f"Circuit breaker unavailable, could not record failure for {hostname}: {e}")
+
+    def reset(self, hostname: str, port: int = 22):
+        """Close the circuit and forget past failures. False if Redis is unavailable."""
+        try:
+            self.client.delete(
+                self._key(hostname, port), self._key(hostname, port, "failures"),
+                self._key(hostname, port, "open"), self._key(hostname, port, "probe"),
+            )
+        except Exception as e:
+            logger.warning(f"Circuit breaker unavailable, could not reset {hostname}: {e}")
+            return False
+        return True
+
+    def states(self, hosts):
+        """Return {(hostname, port): state dict} for many hosts in one round-trip."""
+        hosts = [(hostname, port or 22) for hostname, port in hosts]
+        try:
+            pipe = self.client.pipeline()
+            for hostname, port in hosts:
+                pipe.hgetall(self._key(hostname, port))
+                pipe.ttl(self._key(hostname, port, "open"))
+            results = pipe.execute()
+        except Exception as e:
+            logger.warning(f"Circuit breaker unavailable, host states unknown: {e}")
+            return {host: {"state": "unknown"} for host in hosts}
+
+        states = {}
+        for i, host in enumerate(hosts):
+            info, ttl = results[2 * i], results[2 * i + 1]
+            state = info.get("state", "closed")
+            if state == "open" and ttl <= 0:
+                state = "half_open"  # cooldown elapsed, next call probes
+            states[host] = {
+                "state": state,
+                "failures": int(info.get("failures", 0)) if state != "closed" else 0,
+                "retry_in": max(ttl, 0) if state == "open" else 0,
+                "last_error": info.get("last_error"),
+                "last_failure_at": float(info["last_failure_at"]) if info.get("last_failure_at") else None,
+                "last_success_at": float(info["last_success_at"]) if info.get("last_success_at") else None,
+            }
+        return states
+
+    def state(self, hostname: str, port: int = 22):
+        return self.states([(hostname, port)])[(hostname, port or 22)]
+
+
+def counts_as_unreachable(error: Exception) -> bool:
+    # Bad credentials are a config problem, not a sign the host is down
+    return not isinstance(error, AuthenticationException)
+
+
+circuit_breaker = CircuitBreaker(
+    redis_client,
+    threshold=settings.CIRCUIT_FAILURE_THRESHOLD,
+    window=settings.CIRCUIT_FAILURE_WINDOW,
+    cooldown=settings.CIRCUIT_OPEN_SECONDS,
+)
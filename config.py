@@ -10,6 +10,64 @@ class Settings(BaseSettings):
     ALGORITHM : str
     ACCESS_TOKEN_EXPIRE_MINUTES : int
 
+    REDIS_URL : str = "redis://localhost:6379/0"
+    RUN_SCHEDULER_IN_API : bool = True  # set false when running `python scheduler.py` separately
+    SCHEDULER_SHARDING : bool = False  # split schedules across all scheduler instances instead of electing one leader
+    CELERY_RESULT_EXPIRES : int = 3600  # seconds task results are kept in Redis
+
+    # Database connection pools
+    DB_POOL_SIZE : int = 5  # API and scheduler processes
+    DB_MAX_OVERFLOW : int = 10
+    WORKER_DB_POOL_SIZE : int = 2  # per Celery worker process; publish threads may use the overflow
+    WORKER_DB_MAX_OVERFLOW : int = 3
+    DB_POOL_TIMEOUT : int = 30  # seconds to wait for a free connection
+    DB_POOL_RECYCLE : int = 1800  # seconds before a connection is replaced
+
+    # SSH connection pool
+    SSH_POOL_MAX_PER_HOST : int = 4
+    SSH_POOL_IDLE_TIMEOUT : int = 300  # seconds an unused connection is kept open
+    SSH_KEEPALIVE_INTERVAL : int = 30  # seconds, 0 disables keepalives
+
+    # Job execution
+    SSH_EXECUTOR_THREADS : int = 128  # worker threads for ad-hoc commands in the API
+    SSH_OUTPUT_MAX_CHARS : int = 1_000_000  # per stream; older output is dropped beyond this
+    JOB_OUTPUT_FLUSH_INTERVAL : float = 1.0  # seconds between partial JobOutput writes
+    FANOUT_DEFAULT_CONCURRENCY : int = 50  # hosts running at once for /jobs/fanout
+    SCHEDULER_BATCH_MIN_RUNS : int = 0  # runs for one server in a tick sent as one run_script_batch task, 0 disables (batched jobs have no live output)
+    BATCH_SSH_CHANNELS : int = 4  # commands of a batch running at once over its connection, each takes a host slot
+
+    # Per-host concurrency across all Celery workers (Redis leases)
+    HOST_MAX_CONCURRENT_JOBS : int = 0  # running run_script/upload_script tasks per server, 0 = unlimited
+    HOST_TAG_LIMITS : dict[str, int] = {}  # per-server limit for servers carrying a tag, e.g. {"db": 2}
+    HOST_SLOT_LEASE_SECONDS : int = 3600  # renewed while the task runs; a crashed worker's lease lapses after this
+    HOST_SLOT_RETRY_DELAY : int = 5  # seconds before a deferred task retries, plus up to as much jitter
+    HOST_SLOT_MAX_DEFERRALS : int = 720  # deferrals before the job is failed
+
+    # Script distribution
+    PUBLISH_CONCURRENCY : int = 16  # parallel transfers per publish_script task
+    PUBLISH_HOST_BANDWIDTH : int = 0  # bytes/s per target host across all workers, 0 = unlimited
+    PUBLISH_TOTAL_BANDWIDTH : int = 0  # bytes/s across all publish transfers on all workers, 0 = unlimited
+    PUBLISH_HOST_SLOT_WAIT : int = 600  # seconds a transfer waits for a host slot before that target fails
+
+    # Per-host circuit breaker (state shared through Redis)
+    CIRCUIT_FAILURE_THRESHOLD : int = 3  # connection failures within the window that open the circuit
+    CIRCUIT_FAILURE_WINDOW : int = 60  # seconds
+    CIRCUIT_OPEN_SECONDS : int = 30  # fail fast for this long before a half-open probe
+
+    # Scheduler fire smoothing
+    SCHEDULE_DEFAULT_SPREAD : int = 0  # seconds, used for schedules without their own spread_seconds
+    SCHEDULER_MAX_FIRES_PER_SECOND : int = 0  # across all schedules, 0 = unlimited
+    SCHEDULER_HOST_FIRES_PER_SECOND : int = 0  # per target server, 0 = unlimited
+
+    # Missed runs (scheduler down or stalled)
+    SCHEDULE_MISFIRE_POLICY : str = "run_once"  # skip | run_once | run_all, for schedules without their own
+    SCHEDULE_MISFIRE_MAX_RUNS : int = 10  # most missed runs replayed per schedule under run_all
+    SCHEDULE_MISFIRE_GRACE : int = 60  # seconds late before a run counts as missed
+
+    # Upcoming runs index (calendar)
+    UPCOMING_HORIZON_HOURS : int = 24  # how far ahead fire times are indexed, 0 disables the index
+    UPCOMING_BUCKET_MINUTES : int = 15  # granularity of the index; calendar buckets are multiples of this
+
     class Config:
         env_file = ".env"
 
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+import pytz
+from croniter import croniter
+
+
+def schedule_timezone(name: str = None):
+    # Schedules without a timezone have always been evaluated in UTC
+    return pytz.timezone(name) if name else pytz.UTC
+
+
+def as_utc(value: datetime, tz=pytz.UTC):
+    """Normalize a DB timestamp to an aware UTC datetime.
+
+    Naive values are taken to be in tz (schedule_jobs.last_run_at is stored
+    as naive UTC, one_time_run as naive wall time of the schedule).
+    """
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = tz.localize(value)
+    return value.astimezone(pytz.UTC)
+
+
+INTERVAL_SAMPLE_START = datetime(2024, 1, 1, tzinfo=pytz.UTC)
+
+
+@lru_cache(maxsize=4096)
+def cron_min_interval(cron_expression: str, samples: int = 64):
+    """Shortest gap in seconds between consecutive fires, or None for an invalid expression.
+
+    Sampled over the first `samples` fires from a fixed date, which catches
+    the short gaps of expressions like "0,5 9 * * *" without a full walk.
+    """
+    if not croniter.is_valid(cron_expression):
+        return None
+    it = croniter(cron_expression, INTERVAL_SAMPLE_START)
+    fires = [it.get_next(float) for _ in range(samples + 1)]
+    return int(min(b - a for a, b in zip(fires, fires[1:])))
+
+
+def next_cron_fire(cron_expression: str, tz, after: datetime) -> datetime:
+    """First fire time of cron_expression strictly after `after`, in UTC."""
+    return croniter(cron_expression, after.astimezone(tz)).get_next(datetime).astimezone(pytz.UTC)
+
+
+def iter_cron_fires(cron_expression: str, tz, start: datetime, end: datetime):
+    """Yield UTC fire times in (start, end]."""
+    it = croniter(cron_expression, start.astimezone(tz))
+    while True:
+        fire_at = it.get_next(datetime).astimezone(pytz.UTC)
+        if fire_at > end:
+            return
+        yield fire_at
+
+
+def last_cron_fires(cron_expression: str, tz, start: datetime, end: datetime, limit: int):
+    """The latest `limit` UTC fire times in (start, end], oldest first.
+
+    Walks backwards from end, so the cost is bounded by limit no matter how
+    long ago start was.
+    """
+    it = croniter(cron_expression, end.astimezone(tz) + timedelta(seconds=1))
+    fires = []
+    while len(fires) < limit:
+        fire_at = it.get_prev(datetime).astimezone(pytz.UTC)
+        if fire_at <= start:
+            break
+        fires.append(fire_at)
+    return fires[::-1]
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, UniqueConstraint, Text, CheckConstraint
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, UniqueConstraint, Text, CheckConstraint, LargeBinary, Float
 from sqlalchemy.sql.expression import text
 from sqlalchemy.sql.sqltypes import TIMESTAMP, DateTime
 
@@ -21,6 +21,9 @@ class Job(Base):
 
     runner = Column(String, ForeignKey('users.runner'), nullable=False)  # Foreign key to Use
     run_at = Column(TIMESTAMP(timezone=True), server_default=text('now()'))
+    lane = Column(String, nullable=True)  # Celery queue: interactive, scheduled or bulk
+    started_at = Column(TIMESTAMP(timezone=True), nullable=True, index=True)  # when a worker picked it up
+    queue_wait = Column(Float, nullable=True)  # seconds between run_at and started_at
     #updated_at = Column(TIMESTAMP(timezone=True), server_default=text('now()'), onupdate=text('now()'))
 
     def __repr__(self):
@@ -32,8 +35,23 @@ class JobOutput(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     job_id = Column(Integer, ForeignKey('jobs.id'), nullable=False)
+    # Plain text is only kept while a job is running (for live tailing); finished
+    # output lives compressed in output_blobs. Read through output_store.read_output.
     stdout = Column(Text, nullable=True)
     stderr = Column(Text, nullable=True)  
+    stdout_blob_id = Column(Integer, ForeignKey('output_blobs.id'), nullable=True)
+    stderr_blob_id = Column(Integer, ForeignKey('output_blobs.id'), nullable=True)
+
+
+class OutputBlob(Base):
+    __tablename__ = "output_blobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String(64), nullable=False, unique=True)  # Hash of the uncompressed text
+    codec = Column(String, nullable=False, default='zlib')
+    size = Column(Integer, nullable=False)  # Uncompressed size in bytes
+    data = Column(LargeBinary, nullable=False)
+    created_at = Column(TIMESTAMP(timezone=True), server_default=text('now()'))
 
 
 class User(Base):
@@ -63,6 +81,10 @@ class Scripts(Base):
     hostname = Column(String, nullable=False)  # Hostname where the script is uploaded
     username = Column(String, nullable=False)  # Username for the remote host
     upload_status = Column(String, nullable=False)  # Upload status (e.g. pending, completed, failed)
+    checksum = Column(String(64), nullable=True)  # SHA-256 of the last uploaded content
+    bytes_sent = Column(Integer, nullable=True)  # by the last upload
+    bytes_saved = Column(Integer, nullable=True)  # by the last upload, when the remote copy was unchanged
+    transfers_skipped = Column(Integer, nullable=False, server_default='0')  # uploads skipped as unchanged, all time
     
     #approved = Column(Boolean, default=False)   
     server_id = Column(Integer, ForeignKey('servers.id'), nullable=False)
@@ -85,6 +107,10 @@ class ScheduleJob(Base):
     last_run_at = Column(DateTime(timezone=True), nullable=True)  # One-time run timestamp (naive)
     timezone = Column(String, nullable=True)  # Timezone name like 'Asia/Kolkata'
     is_active = Column(Boolean, default=True)  # To manage active/inactive status
+    spread_seconds = Column(Integer, nullable=True)  # fire up to this many seconds after the cron time
+    misfire_policy = Column(String, nullable=True)  # skip | run_once | run_all
+    misfire_limit = Column(Integer, nullable=True)  # most missed runs replayed under run_all
+    eta_task_id = Column(String, nullable=True)  # Celery task that fires a one-time run
 
     last_run_at = Column(DateTime(timezone=False), nullable=True)
 
@@ -118,14 +144,40 @@ class Server(Base):
     __table_args__ = (UniqueConstraint('hostname', 'username', name='unique_server_per_host'),)  # Ensure unique server per host
 
 
-#Upadtes to be added
-# class ScriptTarget(Base):
-#     __tablename__ = 'script_targets'
+class ScriptTarget(Base):
+    __tablename__ = 'script_targets'
 
-#     id = Column(Integer, primary_key=True, index=True)
-#     script_id = Column(Integer, ForeignKey('scripts.id'), nullable=False)
-#     server_id = Column(Integer, ForeignKey('servers.id'), nullable=False)
+    id = Column(Integer, primary_key=True, index=True)
+    script_id = Column(Integer, ForeignKey('scripts.id', ondelete='CASCADE'), nullable=False)
+    server_id = Column(Integer, ForeignKey('servers.id', ondelete='CASCADE'), nullable=False)
+    upload_status = Column(String, nullable=False, default='On Queue')  # On Queue, Uploading, Completed, Unchanged, Failed
+    checksum = Column(String(64), nullable=True)  # SHA-256 of the content on this server
+    bytes_sent = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+    updated_at = Column(TIMESTAMP(timezone=True), server_default=text('now()'), onupdate=text('now()'))
 
+    __table_args__ = (UniqueConstraint('script_id', 'server_id', name='unique_target_per_script'),)
+
+
+class SchedulerMember(Base):
+    __tablename__ = "scheduler_members"
+
+    instance_id = Column(String, primary_key=True)  # hostname:pid:random suffix
+    heartbeat_at = Column(TIMESTAMP(timezone=True), server_default=text('now()'), nullable=False)
+    started_at = Column(TIMESTAMP(timezone=True), server_default=text('now()'))
+
+
+class UpcomingRun(Base):
+    __tablename__ = "upcoming_runs"
+
+    # Runs per schedule per time bucket, maintained by the scheduler for the calendar view
+    schedule_id = Column(Integer, ForeignKey('schedule_jobs.id', ondelete='CASCADE'), primary_key=True)
+    bucket_start = Column(TIMESTAMP(timezone=True), primary_key=True, index=True)
+    server_id = Column(Integer, nullable=False)
+    runs = Column(Integer, nullable=False)
+
+
+#Upadtes to be added
 # class JobTarget(Base):
 #     __tablename__ = 'job_targets'
 
@@ -8,6 +8,6 @@ done
 
 echo "Start Celery"
 
-celery -A main.celery worker --loglevel=info &
+celery -A main.celery worker -Q interactive,scheduled,bulk --loglevel=info &
 
 uvicorn main:app --host 0.0.0.0 --port 8000 --reload
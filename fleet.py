@@ -0,0 +1,29 @@
+from typing import List, Optional
+
+from sqlalchemy.orm import Session
+
+from db_stuffs.models import Server
+
+
+def parse_tags(tags: Optional[str]) -> set:
+    if not tags:
+        return set()
+    return {t.strip().lower() for t in tags.replace(";", ",").split(",") if t.strip()}
+
+
+def select_servers(db: Session, server_ids: Optional[List[int]] = None, tag: Optional[str] = None) -> List[Server]:
+    """Resolve a fan-out target list from explicit server IDs and/or a tag.
+
+    Server.tags is a free-form comma separated string, so the LIKE filter only
+    narrows the candidates and the exact tag match is done here.
+    """
+    servers = {}
+    if server_ids:
+        for server in db.query(Server).filter(Server.id.in_(server_ids)).all():
+            servers[server.id] = server
+    if tag:
+        wanted = tag.strip().lower()
+        for server in db.query(Server).filter(Server.tags.ilike(f"%{wanted}%")).all():
+            if wanted in parse_tags(server.tags):
+                servers[server.id] = server
+    return sorted(servers.values(), key=lambda s: s.id)
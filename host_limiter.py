@@ -0,0 +1,119 @@
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from config import settings
+from fleet import parse_tags
+from logger import logger
+from redis_client import redis_client
+
+
+# Drop expired leases, then take one if the host is under its limit
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[4])
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[3]))
+    return 1
+end
+return 0
+"""
+
+UNLIMITED = ()  # lease handed out when no limit applies or Redis is unavailable
+
+
+class HostLimiter:
+    """Concurrency limit per server shared by every Celery worker.
+
+    Each running task holds a lease in a Redis sorted set per host, scored by
+    its expiry. hold() renews the lease while the task runs, so only the
+    leases of crashed workers lapse after lease_seconds.
+    A task that finds its host full is deferred by the caller rather than
+    blocking a worker slot. If Redis is unreachable tasks run unthrottled.
+    """
+
+    def __init__(self, client, lease_seconds: int, prefix: str = "orchkid:hostslots"):
+        self.client = client
+        self.lease_seconds = lease_seconds
+        self.prefix = prefix
+        self._acquire = client.register_script(ACQUIRE_SCRIPT)
+
+    def _key(self, hostname: str):
+        return f"{self.prefix}:{hostname}"
+
+    @staticmethod
+    def limit_for(tags: str = None):
+        """HOST_MAX_CONCURRENT_JOBS, or the lowest HOST_TAG_LIMITS entry among the server's tags."""
+        limits = [settings.HOST_TAG_LIMITS[tag] for tag in parse_tags(tags) if tag in settings.HOST_TAG_LIMITS]
+        if settings.HOST_MAX_CONCURRENT_JOBS > 0:
+            limits.append(settings.HOST_MAX_CONCURRENT_JOBS)
+        return min(limits) if limits else 0
+
+    def acquire(self, hostname: str, limit: int):
+        """A lease to release when done, or None if the host is at its limit."""
+        if limit <= 0:
+            return UNLIMITED
+        token = uuid.uuid4().hex
+        try:
+            granted = self._acquire(keys=[self._key(hostname)], args=[time.time(), limit, self.lease_seconds, token])
+        except Exception as e:
+            logger.warning(f"Host limiter unavailable, not throttling {hostname}: {e}")
+            return UNLIMITED
+        return (hostname, token) if granted else None
+
+    def acquire_wait(self, hostname: str, limit: int, timeout: float, poll: float):
+        """acquire(), polling every `poll` seconds for up to `timeout`. None if it never freed up.
+
+        For work that cannot be re-queued, such as one host of a publish task.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            lease = self.acquire(hostname, limit)
+            if lease is not None or time.monotonic() >= deadline:
+                return lease
+            time.sleep(poll)
+
+    def renew(self, lease):
+        hostname, token = lease
+        key = self._key(hostname)
+        try:
+            # XX: a lease that already lapsed is not brought back
+            pipe = self.client.pipeline()
+            pipe.zadd(key, {token: time.time() + self.lease_seconds}, xx=True)
+            pipe.expire(key, self.lease_seconds)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Could not renew host slot on {hostname}: {e}")
+
+    def _renew_until(self, leases, stop):
+        while not stop.wait(self.lease_seconds / 3):
+            for lease in leases:
+                self.renew(lease)
+
+    @contextmanager
+    def hold(self, *leases):
+        """Keep the leases alive while the block runs, then release them."""
+        leases = [lease for lease in leases if lease]
+        stop = threading.Event()
+        if leases:
+            threading.Thread(target=self._renew_until, args=(leases, stop), name="host-slot-renewer", daemon=True).start()
+        try:
+            yield
+        finally:
+            stop.set()
+            for lease in leases:
+                self.release(lease)
+
+    def release(self, lease):
+        if not lease:
+            return
+        hostname, token = lease
+        try:
+            self.client.zrem(self._key(hostname), token)
+        except Exception as e:
+            logger.warning(f"Could not release host slot on {hostname}, it lapses after {self.lease_seconds}s: {e}")
+
+
+host_limiter = HostLimiter(redis_client, lease_seconds=settings.HOST_SLOT_LEASE_SECONDS)
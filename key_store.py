@@ -0,0 +1,59 @@
+import os
+import threading
+
+from paramiko import PKey
+
+from logger import logger
+
+
+class PrivateKeyStore:
+    """In-memory cache of parsed private keys.
+
+    Each Server.key_path is read and parsed once; the cached key is reused
+    until the file's mtime, inode or size changes on disk. The key type
+    (Ed25519, ECDSA or RSA) is detected from the file contents.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys = {}  # path -> ((st_mtime_ns, st_ino, st_size), pkey)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key_path: str):
+        path = str(key_path)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            logger.error(f"Private key not found at {path}")
+            raise FileNotFoundError(f"Private key not found at {path}")
+        fingerprint = (st.st_mtime_ns, st.st_ino, st.st_size)
+
+        with self._lock:
+            cached = self._keys.get(path)
+            if cached and cached[0] == fingerprint:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        # Parse outside the lock so a slow disk doesn't serialize other hosts
+        pkey = PKey.from_path(path)
+        logger.info(f"Loaded {pkey.get_name()} private key from {path}")
+
+        with self._lock:
+            self._keys[path] = (fingerprint, pkey)
+        return pkey
+
+    def invalidate(self, key_path: str = None):
+        with self._lock:
+            if key_path is None:
+                self._keys.clear()
+            else:
+                self._keys.pop(str(key_path), None)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "cached_keys": len(self._keys)}
+
+
+key_store = PrivateKeyStore()
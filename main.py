@@ -8,7 +8,7 @@ from db_stuffs.database import get_db
 from contextlib import asynccontextmanager
 from db_stuffs.database import engine
 from db_stuffs.models import Base
-from routers import jobs, users, scripts, servers
+from routers import jobs, users, scripts, servers, scheduling
 from scheduler import scheduler_loop
 import asyncio
 from fastapi.middleware.cors import CORSMiddleware
@@ -22,6 +22,9 @@ from db_stuffs.models import ScheduleJob, User, Job
 from db_stuffs.database import get_db
 from oauth import get_current_user
 from sqlalchemy.orm import Session
+from key_store import key_store
+import ssh_executor
+from config import settings
 
 
 # Create the database tables if they don't exist
@@ -33,17 +36,20 @@ static_files = StaticFiles(directory="static")
 async def lifespan(app: FastAPI):
     logger.info("Starting application lifespan")
     process = tailwind.compile(static_files.directory + "/css/styles.css")
-    scheduler_task = asyncio.create_task(scheduler_loop())
+    # Every replica may start the loop; leader election lets only one of them schedule
+    scheduler_task = asyncio.create_task(scheduler_loop()) if settings.RUN_SCHEDULER_IN_API else None
 
     try:
         yield
     finally:
         logger.info("Stopping application lifespan")
-        scheduler_task.cancel()
-        try:
-            await scheduler_task
-        except asyncio.CancelledError:
-            logger.info("Scheduler task cancelled successfully")
+        if scheduler_task:
+            scheduler_task.cancel()
+            try:
+                await scheduler_task
+            except asyncio.CancelledError:
+                logger.info("Scheduler task cancelled successfully")
+        ssh_executor.shutdown()
     
 
 app = FastAPI(lifespan = lifespan) 
@@ -70,6 +76,7 @@ app.include_router(jobs.router)
 app.include_router(users.router)
 app.include_router(scripts.router)
 app.include_router(servers.router)
+app.include_router(scheduling.router)
 
 
 
@@ -146,6 +153,6 @@ def history_page(request: Request, script_id: int):
 @app.get("/health")
 async def health_check():
     logger.info("Health check requested")
-    return {"status": "healthy"}
+    return {"status": "healthy", "key_cache": key_store.stats()}
 
 
@@ -0,0 +1,91 @@
+import hashlib
+import zlib
+
+from sqlalchemy import case, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from config import settings
+from db_stuffs.database import session_scope
+from db_stuffs.models import JobOutput, OutputBlob
+
+
+CODEC = "zlib"
+COMPRESSION_LEVEL = 6
+
+
+def _decompress(codec: str, data: bytes) -> str:
+    if codec == "zlib":
+        return zlib.decompress(data).decode("utf-8")
+    raise ValueError(f"Unknown output codec {codec}")
+
+
+def store_blob(db: Session, text: str):
+    """Return the id of the blob holding text, inserting it if it is new.
+
+    Recurring jobs mostly print the same thing, so blobs are keyed by the
+    SHA-256 of their content and shared between job outputs.
+    """
+    if not text:
+        return None
+    raw = text.encode("utf-8")
+    digest = hashlib.sha256(raw).hexdigest()
+
+    blob_id = db.scalar(select(OutputBlob.id).where(OutputBlob.sha256 == digest))
+    if blob_id:
+        return blob_id
+
+    # ON CONFLICT covers two workers storing the same output at the same time
+    db.execute(
+        pg_insert(OutputBlob)
+        .values(sha256=digest, codec=CODEC, size=len(raw), data=zlib.compress(raw, COMPRESSION_LEVEL))
+        .on_conflict_do_nothing(index_elements=["sha256"])
+    )
+    return db.scalar(select(OutputBlob.id).where(OutputBlob.sha256 == digest))
+
+
+def append_output(db: Session, output_id: int, out_chunk: str, err_chunk: str):
+    """Append streamed chunks to a running job's JobOutput row. The caller commits.
+
+    Each stream stops growing at SSH_OUTPUT_MAX_CHARS so a chatty job can't
+    bloat the row; store_output replaces it with the kept tail at the end.
+    """
+    limit = settings.SSH_OUTPUT_MAX_CHARS
+
+    def grow(column, chunk):
+        current = func.coalesce(column, "")
+        return case((func.length(current) < limit, func.left(current + chunk, limit)), else_=column)
+
+    db.query(JobOutput).filter(JobOutput.id == output_id).update({
+        JobOutput.stdout: grow(JobOutput.stdout, out_chunk),
+        JobOutput.stderr: grow(JobOutput.stderr, err_chunk),
+    }, synchronize_session=False)
+
+
+def live_output(output_id: int):
+    """on_output callback for run_ssh_command that writes through its own short sessions."""
+    def flush(out_chunk, err_chunk):
+        with session_scope() as db:
+            append_output(db, output_id, out_chunk, err_chunk)
+            db.commit()
+    return flush
+
+
+def store_output(db: Session, job_output: JobOutput, stdout: str, stderr: str):
+    """Move finished output into deduplicated blobs. The caller commits."""
+    job_output.stdout_blob_id = store_blob(db, stdout)
+    job_output.stderr_blob_id = store_blob(db, stderr)
+    job_output.stdout = None
+    job_output.stderr = None
+
+
+def read_output(db: Session, job_output: JobOutput):
+    """Return (stdout, stderr) for a row, whether it is live text or compressed."""
+    values = []
+    for plain, blob_id in ((job_output.stdout, job_output.stdout_blob_id), (job_output.stderr, job_output.stderr_blob_id)):
+        if blob_id:
+            blob = db.get(OutputBlob, blob_id)
+            values.append(_decompress(blob.codec, blob.data))
+        else:
+            values.append(plain or "")
+    return values[0], values[1]
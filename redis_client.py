@@ -0,0 +1,8 @@
+import redis
+
+from config import settings
+
+
+# Shared by the API and Celery workers for cross-process coordination state.
+# redis-py re-creates its connections after a fork, so this is prefork safe.
+redis_client = redis.Redis.from_url(settings.REDIS_URL, decode_responses=True, socket_timeout=2)
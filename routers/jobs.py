@@ -1,15 +1,27 @@
 from fastapi import FastAPI, HTTPException, APIRouter, Depends
-from schemas import SSHCommandRequest, JobResponse
+from schemas import SSHCommandRequest, JobResponse, FanoutRequest, FanoutResponse, FanoutJobResult, LaneWaitResponse
 from sqlalchemy.orm import Session  
 from db_stuffs.database import get_db
-from db_stuffs.models import Job, JobOutput, Server  # Import Job model if needed for database operations
+from db_stuffs.models import Job, JobOutput, Server, Scripts, ScriptTarget  # Import Job model if needed for database operations
 from db_stuffs.database import engine
 from db_stuffs.models import Base
-from ssh_utils import run_ssh_command
+from ssh_executor import run_ssh_command_async
+from fastapi.concurrency import run_in_threadpool
 from logger import logger  # ✅ Import centralized logger
 from oauth import get_current_user
 from db_stuffs import models
 from typing import List 
+from fastapi.responses import StreamingResponse
+from db_stuffs.database import SessionLocal
+import asyncio
+import json
+from sqlalchemy import insert, func
+from datetime import timedelta
+from fleet import select_servers
+from output_store import store_output, read_output, live_output
+from tasks import enqueue_run
+from celery_worker import BULK_LANE
+from config import settings
 
 
 
@@ -21,12 +33,7 @@ router = APIRouter(
 ALLOWED_COMMANDS = ['uptime','hostname','df -h','free -m','whoami']  
 
 
-@router.post("/run")
-async def run_ssh_command_endpoint(req: SSHCommandRequest, db : Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
-    logger.info("Service opened by : " + current_user.runner)
-    #logger.info("Authenticated user: " + )
-    logger.info("Database session started")
-
+def _create_job(req: SSHCommandRequest, db: Session, current_user: models.User):
     server_exits = db.query(Server).filter(Server.id == req.server_id).first()
     
     if not server_exits:
@@ -86,45 +93,67 @@ async def run_ssh_command_endpoint(req: SSHCommandRequest, db : Session = Depend
     logger.info(f"Received SSH command request: {server_exits.hostname} - {req.command}")
     
     db.add(job)
+    db.flush()
+    # Created up front so the output can be tailed while the command runs
+    job_output = JobOutput(job_id=job.id, stdout="", stderr="")
+    db.add(job_output)
+    db.flush()
+    job_id, output_id = job.id, job_output.id
     db.commit()
-    db.refresh(job)
-    logger.info(f"Job created with ID: {job.id}")
-    logger.info(f"Running command on {server_exits.hostname} as {server_exits.username}")
+    logger.info(f"Job created with ID: {job_id}")
 
+    # Plain values only: the ORM objects must not lazy-load on the event loop
+    return job_id, output_id, (server_exits.hostname, server_exits.username, server_exits.key_path, server_exits.port)
 
-    try:
-        out, err = run_ssh_command(server_exits.hostname, server_exits.username, req.command, server_exits.key_path)
 
-          
-        job_output = JobOutput(
-            job_id=job.id,
-            stdout=out,
-            stderr=err
-        )
-        db.add(job_output)
+def _save_job_output(job_id: int, output_id: int, out, err, db: Session):
+    job = db.query(Job).filter(Job.id == job_id).first()
+    job_output = db.query(JobOutput).filter(JobOutput.id == output_id).first()
+    store_output(db, job_output, out, err)
+    db.commit()
+    logger.info(f"Job output saved with ID: {output_id}")
+    logger.info(f"Job {job_id} output saved successfully")          
+    
+    
+    if err and not out:
+        logger.warning(f"Command execution on {job.hostname} returned an error: {err}")
+        job.command_status = "failed"
         db.commit()
-        db.refresh(job_output)  
-        logger.info(f"Job output saved with ID: {job_output.id}")
-        logger.info(f"Job {job.id} output saved successfully")          
-        
-        
-        if err and not out:
-            logger.warning(f"Command execution on {server_exits.hostname} returned an error: {err}")
-            job.command_status = "failed"
-            db.commit()
-        else:
-            logger.info(f"Command executed successfully on {server_exits.hostname}")
-            job.command_status = "completed"
-            db.commit()
-            logger.info(f"Job {job.id} status updated to completed")
+    else:
+        logger.info(f"Command executed successfully on {job.hostname}")
+        job.command_status = "completed"
+        db.commit()
+        logger.info(f"Job {job_id} status updated to completed")
+
+
+def _mark_job_failed(job_id: int, db: Session):
+    db.query(Job).filter(Job.id == job_id).update({Job.command_status: "failed"})
+    db.commit()
+    logger.error(f"Job {job_id} status updated to failed")
+
+
+@router.post("/run")
+async def run_ssh_command_endpoint(req: SSHCommandRequest, db : Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    logger.info("Service opened by : " + current_user.runner)
+    #logger.info("Authenticated user: " + )
+    logger.info("Database session started")
+
+    # Blocking work (sync SQLAlchemy, paramiko) is pushed off the event loop so
+    # a slow host never stalls other requests on this worker.
+    job_id, output_id, (hostname, username, key_path, port) = await run_in_threadpool(_create_job, req, db, current_user)
+    logger.info(f"Running command on {hostname} as {username}")
+
+
+    try:
+        out, err = await run_ssh_command_async(hostname, username, req.command, key_path, port=port, on_output=live_output(output_id))
+
+        await run_in_threadpool(_save_job_output, job_id, output_id, out, err, db)
         return {"stdout": out, "stderr": err}
     
       
     except Exception as e:
         logger.error(f"SSH execution failed: {e}", exc_info=True)
-        job.command_status = "failed"
-        db.commit()
-        logger.error(f"Job {job.id} status updated to failed")
+        await run_in_threadpool(_mark_job_failed, job_id, db)
         raise HTTPException(status_code=500, detail=str(e))
 
     finally:
@@ -132,6 +161,119 @@ async def run_ssh_command_endpoint(req: SSHCommandRequest, db : Session = Depend
         db.close() 
 
 
+def _create_fanout_jobs(req: FanoutRequest, db: Session, current_user: models.User):
+    servers = select_servers(db, req.server_ids, req.tag)
+    if not servers:
+        logger.error(f"No servers matched fan-out selector ids={req.server_ids} tag={req.tag}")
+        raise HTTPException(status_code=404, detail="No servers matched")
+
+    script = None
+    if req.script_id:
+        script = db.query(Scripts).filter(Scripts.id == req.script_id).first()
+        if not script:
+            logger.error(f"Script with ID {req.script_id} not found")
+            raise HTTPException(status_code=404, detail="Script not found")
+
+        # The script file only exists on its own server and where it was published
+        published = {script.server_id} | {
+            server_id for server_id, in db.query(ScriptTarget.server_id)
+            .filter(ScriptTarget.script_id == script.id, ScriptTarget.upload_status.in_(("Completed", "Unchanged")))
+        }
+        skipped = [server.hostname for server in servers if server.id not in published]
+        servers = [server for server in servers if server.id in published]
+        if skipped:
+            logger.warning(f"Script {script.id} is not published to {', '.join(skipped)}, skipping them")
+        if not servers:
+            raise HTTPException(status_code=409, detail="Script is not published to any of the selected servers")
+
+    rows = [dict(
+        command=f"bash /home/{server.username}/bin/{script.file_name}" if script else req.command,
+        hostname=server.hostname,
+        key_path=server.key_path,
+        username=server.username,
+        server_id=server.id,
+        job_id=script.id if script else None,
+        command_description=req.command_description or (script.description if script else None),
+        runner=current_user.runner,
+        command_status="queued" if script else "running",
+        lane=BULK_LANE if script else None,
+    ) for server in servers]
+
+    # One INSERT for the whole fleet instead of a round-trip per host
+    job_ids = db.scalars(insert(Job).returning(Job.id, sort_by_parameter_order=True), rows).all()
+    output_ids = [None] * len(job_ids)
+    if not script:
+        # Ad-hoc commands run here; their output rows exist up front so they can be tailed
+        output_ids = db.scalars(
+            insert(JobOutput).returning(JobOutput.id, sort_by_parameter_order=True),
+            [dict(job_id=job_id, stdout="", stderr="") for job_id in job_ids],
+        ).all()
+    db.commit()
+    logger.info(f"Created {len(job_ids)} fan-out jobs for {current_user.runner}")
+
+    targets = [
+        (job_id, server.id, server.hostname, server.username, server.key_path, server.port, output_id)
+        for job_id, server, output_id in zip(job_ids, servers, output_ids)
+    ]
+    return targets, (script.id if script else None)
+
+
+def _save_fanout_results(results, db: Session):
+    statuses = {}
+    outputs = {o.job_id: o for o in db.query(JobOutput).filter(JobOutput.job_id.in_([r.job_id for r in results]))}
+    for result in results:
+        job_output = outputs.get(result.job_id) or JobOutput(job_id=result.job_id)
+        store_output(db, job_output, result.stdout, result.stderr)
+        db.add(job_output)
+        statuses.setdefault(result.command_status, []).append(result.job_id)
+    for status, job_ids in statuses.items():
+        db.query(Job).filter(Job.id.in_(job_ids)).update({Job.command_status: status}, synchronize_session=False)
+    db.commit()
+
+
+@router.post("/fanout", response_model=FanoutResponse)
+async def fanout_endpoint(req: FanoutRequest, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    logger.info(f"Fan-out requested by {current_user.runner}")
+
+    if req.command and not current_user.is_superuser and req.command not in ALLOWED_COMMANDS:
+        logger.error(f"The command {req.command} is in blacklist and cannot be executed.")
+        raise HTTPException(status_code=403, detail="Command not allowed")
+    if req.script_id and not current_user.is_superuser:
+        logger.error("User is not authorized to fan out scripts.")
+        raise HTTPException(status_code=403, detail="Not authorized to fan out scripts")
+
+    targets, script_id = await run_in_threadpool(_create_fanout_jobs, req, db, current_user)
+
+    if script_id:
+        # Scripts run on the Celery workers; their concurrency is the worker pool size
+        results = []
+        for job_id, server_id, hostname, *_ in targets:
+            enqueue_run(script_id, job_id, BULK_LANE)
+            results.append(FanoutJobResult(job_id=job_id, server_id=server_id, hostname=hostname, command_status="queued"))
+        logger.info(f"Queued script {script_id} on {len(results)} servers")
+        return FanoutResponse(total=len(results), queued=len(results), jobs=results)
+
+    concurrency = min(req.concurrency or settings.FANOUT_DEFAULT_CONCURRENCY, settings.SSH_EXECUTOR_THREADS)
+    limit = asyncio.Semaphore(concurrency)
+
+    async def run_one(job_id, server_id, hostname, username, key_path, port, output_id):
+        async with limit:
+            try:
+                out, err = await run_ssh_command_async(hostname, username, req.command, key_path, port=port, on_output=live_output(output_id))
+            except Exception as e:
+                logger.error(f"Fan-out to {hostname} failed: {e}", exc_info=True)
+                out, err = "", str(e)
+        status = "failed" if err and not out else "completed"
+        return FanoutJobResult(job_id=job_id, server_id=server_id, hostname=hostname, command_status=status, stdout=out, stderr=err)
+
+    logger.info(f"Running '{req.command}' on {len(targets)} servers with concurrency {concurrency}")
+    results = await asyncio.gather(*(run_one(*target) for target in targets))
+    await run_in_threadpool(_save_fanout_results, results, db)
+
+    completed = sum(1 for r in results if r.command_status == "completed")
+    return FanoutResponse(total=len(results), completed=completed, failed=len(results) - completed, jobs=results)
+
+
 @router.get("/v1/all", response_model=List[JobResponse])  
 def get_all_jobs(db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     logger.info("Fetching all jobs from the database")
@@ -177,6 +319,29 @@ def get_user_jobs(db: Session = Depends(get_db), current_user: models.User = Dep
     ) for job in jobs]
 
 
+@router.get("/v1/lanes", response_model=List[LaneWaitResponse])
+def get_lane_waits(hours: int = 1, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    logger.info(f"Fetching queue wait per lane for the last {hours}h")
+
+    since = func.now() - timedelta(hours=hours)
+    rows = (
+        db.query(
+            Job.lane,
+            func.count(Job.id),
+            func.avg(Job.queue_wait),
+            func.percentile_cont(0.95).within_group(Job.queue_wait),
+            func.max(Job.queue_wait),
+        )
+        .filter(Job.started_at >= since, Job.lane.isnot(None))
+        .group_by(Job.lane)
+        .all()
+    )
+    return [
+        LaneWaitResponse(lane=lane, jobs=jobs, avg_wait=avg or 0.0, p95_wait=p95 or 0.0, max_wait=longest or 0.0)
+        for lane, jobs, avg, p95, longest in rows
+    ]
+
+
 @router.get("/v1/{job_id}", response_model=JobResponse)
 def get_job_by_id(job_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
     logger.info(f"Fetching job with ID: {job_id}")
@@ -198,7 +363,70 @@ def get_job_by_id(job_id: int, db: Session = Depends(get_db), current_user: mode
         command_description=job.command_description,
         command_status=job.command_status,
         runner=job.runner,
-        run_at=job.run_at    
+        run_at=job.run_at,
+        lane=job.lane,
+        queue_wait=job.queue_wait
         )
 
-    
\ No newline at end of file
+
+LIVE_JOB_STATUSES = ("pending", "queued", "running")
+STREAM_POLL_INTERVAL = 1  # seconds
+
+
+def _poll_job_output(job_id: int):
+    with SessionLocal() as db:
+        status = db.query(Job.command_status).filter(Job.id == job_id).scalar()
+        output = db.query(JobOutput).filter(JobOutput.job_id == job_id).order_by(JobOutput.id.desc()).first()
+        stdout, stderr = read_output(db, output) if output else ("", "")
+    return status, stdout, stderr
+
+
+def _sse(event: str, data: dict):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.get("/v1/{job_id}/stream")
+async def stream_job_output(job_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    logger.info(f"Streaming output for job ID: {job_id}")
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if not job:
+        logger.error(f"Job with ID {job_id} not found")
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not current_user.is_superuser and job.runner != current_user.runner:
+        logger.warning("User is not superuser, returning 403 Forbidden")
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    async def events():
+        sent = {"stdout": 0, "stderr": 0}
+        while True:
+            status, stdout, stderr = await run_in_threadpool(_poll_job_output, job_id)
+            for name, text in (("stdout", stdout), ("stderr", stderr)):
+                if len(text) < sent[name]:
+                    # Final output replaced the partial chunks (e.g. it was truncated)
+                    yield _sse("reset", {"stream": name, "text": text})
+                elif len(text) > sent[name]:
+                    yield _sse("output", {"stream": name, "text": text[sent[name]:]})
+                sent[name] = len(text)
+
+            if status not in LIVE_JOB_STATUSES:
+                yield _sse("end", {"status": status})
+                return
+            await asyncio.sleep(STREAM_POLL_INTERVAL)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@router.get("/v1/{job_id}/output")
+def get_job_output(job_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(get_current_user)):
+    logger.info(f"Fetching output for job ID: {job_id}")
+    job = db.query(Job).filter(Job.id == job_id).first()
+    if not job:
+        logger.error(f"Job with ID {job_id} not found")
+        raise HTTPException(status_code=404, detail="Job not found")
+    if not current_user.is_superuser and job.runner != current_user.runner:
+        logger.warning("User is not superuser, returning 403 Forbidden")
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    output = db.query(JobOutput).filter(JobOutput.job_id == job_id).order_by(JobOutput.id.desc()).first()
+    stdout, stderr = read_output(db, output) if output else ("", "")
+    return {"job_id": job_id, "command_status": job.command_status, "stdout": stdout, "stderr": stderr}
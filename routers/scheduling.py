@@ -0,0 +1,95 @@
+from datetime import datetime, timedelta
+from typing import Optional
+from collections import defaultdict
+import pytz
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func, distinct
+from sqlalchemy.orm import Session
+from schemas import SchedulerMetricsResponse, CalendarResponse, CalendarBucket
+from db_stuffs.database import get_db
+from db_stuffs.models import ScheduleJob, Scripts, UpcomingRun
+from logger import logger
+from oauth import get_current_user
+from scheduler_metrics import scheduler_metrics
+from cron_utils import schedule_timezone, as_utc
+from config import settings
+
+
+router = APIRouter(
+    prefix="/scheduler",
+    tags=["Scheduler"]
+)
+
+
+@router.get("/metrics", response_model=SchedulerMetricsResponse)
+async def get_scheduler_metrics(current_user = Depends(get_current_user)):
+    logger.info(f"Recived request for scheduler metrics from runner {current_user.runner}")
+
+    try:
+        return scheduler_metrics.snapshot()
+    except Exception as e:
+        logger.error(f"Could not read scheduler metrics: {e}")
+        raise HTTPException(status_code=503, detail="Scheduler metrics unavailable")
+
+
+@router.get("/calendar", response_model=CalendarResponse)
+async def get_calendar(
+    hours: int = Query(24, ge=1),
+    bucket_minutes: int = Query(60, ge=1),
+    server_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user = Depends(get_current_user)
+):
+    logger.info(f"Recived request for the schedule calendar ({hours}h by {bucket_minutes}m) from runner {current_user.runner}")
+
+    if settings.UPCOMING_HORIZON_HOURS <= 0:
+        raise HTTPException(status_code=503, detail="Upcoming runs index is disabled")
+    if hours > settings.UPCOMING_HORIZON_HOURS:
+        raise HTTPException(status_code=400, detail=f"Only the next {settings.UPCOMING_HORIZON_HOURS} hours are indexed")
+
+    # Calendar buckets are whole multiples of the index buckets
+    step = settings.UPCOMING_BUCKET_MINUTES
+    bucket_minutes = max(step, -(-bucket_minutes // step) * step)
+    width = bucket_minutes * 60
+
+    now = datetime.now(pytz.UTC)
+    start = datetime.fromtimestamp(int(now.timestamp()) // (step * 60) * (step * 60), pytz.UTC)
+    end = now + timedelta(hours=hours)
+
+    bucket = func.to_timestamp(func.floor(func.extract("epoch", UpcomingRun.bucket_start) / width) * width)
+    query = (
+        db.query(bucket.label("start"), func.sum(UpcomingRun.runs), func.count(distinct(UpcomingRun.schedule_id)))
+        .filter(UpcomingRun.bucket_start >= start, UpcomingRun.bucket_start < end)
+        .group_by(bucket)
+    )
+    if server_id is not None:
+        query = query.filter(UpcomingRun.server_id == server_id)
+
+    buckets = defaultdict(lambda: [0, 0])  # bucket start -> [runs, schedules]
+    for bucket_at, runs, schedules in query:
+        buckets[bucket_at.astimezone(pytz.UTC)] = [int(runs), schedules]
+
+    # One-time runs wait in Celery, not in the index
+    one_time = db.query(ScheduleJob.one_time_run, ScheduleJob.timezone).join(Scripts, ScheduleJob.script_id == Scripts.id).filter(
+        ScheduleJob.is_active.is_(True),
+        ScheduleJob.one_time_run.isnot(None),
+        ScheduleJob.cron_expression.is_(None),
+        ScheduleJob.last_run_at.is_(None),
+    )
+    if server_id is not None:
+        one_time = one_time.filter(Scripts.server_id == server_id)
+    for run_at, tz in one_time:
+        run_at = as_utc(run_at, schedule_timezone(tz))
+        if start <= run_at < end:
+            key = datetime.fromtimestamp(int(run_at.timestamp()) // width * width, pytz.UTC)
+            buckets[key][0] += 1
+            buckets[key][1] += 1
+
+    result = [CalendarBucket(start=key, runs=runs, schedules=schedules) for key, (runs, schedules) in sorted(buckets.items())]
+    return CalendarResponse(
+        start=start,
+        end=end,
+        bucket_minutes=bucket_minutes,
+        total_runs=sum(b.runs for b in result),
+        buckets=result,
+    )
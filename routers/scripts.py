@@ -1,16 +1,21 @@
 from fastapi import FastAPI, HTTPException, APIRouter, Depends
-from schemas import ScriptDetails,ScriptUploadRequest, JobResponse, ScriptsResponse, ScriptUpdateRequest, ScheduleJobRequest, ScheduleJobResponse, ScheduleJobEdit
+from schemas import ScriptDetails,ScriptUploadRequest, JobResponse, ScriptsResponse, ScriptUpdateRequest, ScheduleJobRequest, ScheduleJobResponse, ScheduleJobEdit, PublishScriptRequest, ScriptTargetResponse
 from sqlalchemy.orm import Session  
 from db_stuffs.database import get_db
-from db_stuffs.models import Job, JobOutput, Scripts, User, ScheduleJob, Server    # Import Job model if needed for database operations
+from db_stuffs.models import Job, JobOutput, Scripts, User, ScheduleJob, Server, ScriptTarget    # Import Job model if needed for database operations
 from db_stuffs.database import engine
 from db_stuffs.models import Base
 from ssh_utils import run_ssh_command
 from logger import logger  # ✅ Import centralized logger
 from oauth import get_current_user
 from typing import List 
-from tasks import run_script, upload_script  # Import the Celery task for running scripts
+from celery_worker import INTERACTIVE_LANE
+from tasks import enqueue_run, upload_script, publish_script, prepare_one_time_run, send_one_time_run, revoke_one_time_run  # Import the Celery task for running scripts
 from scp_utils import run_scp_command
+from fleet import select_servers
+from schedule_events import notify_schedule_change, notify_schedules_using
+from output_store import store_output
+from cron_utils import cron_min_interval
 #from celery import current_app
 
 
@@ -51,7 +56,8 @@ async def upload_script_endpoint(
             destination=f"/home/{server_exits.username}/bin/{req.file_name}",
             hostname=server_exits.hostname,
             username=server_exits.username,
-            key_path=server_exits.key_path
+            key_path=server_exits.key_path,
+            port=server_exits.port or 22
         )
         logger.info(f"Upload task enqueued for script {req.file_name} to {server_exits.hostname} with task ID: {task.id}")
     except Exception as e:
@@ -113,6 +119,80 @@ async def upload_script_endpoint(
     }
 
 
+@router.post("/{script_id}/publish", status_code=201)
+async def publish_script_endpoint(
+    script_id: int,
+    req: PublishScriptRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    logger.info(f"Received request to publish script ID {script_id} by {current_user.runner}")
+
+    if not current_user.is_superuser:
+        logger.error("User is not authorized to publish scripts.")
+        raise HTTPException(status_code=403, detail="Not authorized to publish scripts")
+
+    script = db.query(Scripts).filter(Scripts.id == script_id).first()
+    if not script:
+        logger.error(f"Script with ID {script_id} not found")
+        raise HTTPException(status_code=404, detail="Script not found")
+
+    servers = select_servers(db, req.server_ids, req.tag)
+    if not servers:
+        logger.error(f"No servers matched publish selector ids={req.server_ids} tag={req.tag}")
+        raise HTTPException(status_code=404, detail="No servers matched")
+
+    existing = {
+        target.server_id: target
+        for target in db.query(ScriptTarget).filter(ScriptTarget.script_id == script_id).all()
+    }
+    targets = []
+    for server in servers:
+        target = existing.get(server.id)
+        if not target:
+            target = ScriptTarget(script_id=script_id, server_id=server.id)
+            db.add(target)
+        target.upload_status = "On Queue"
+        target.error = None
+        targets.append(target)
+    db.commit()
+
+    task = publish_script.delay(script_id, [target.id for target in targets])
+    logger.info(f"Publish task {task.id} enqueued for script {script_id} to {len(targets)} servers")
+
+    return {
+        "message": "Script publish queued",
+        "script_id": script_id,
+        "task_id": task.id,
+        "targets": [ScriptTargetResponse.model_validate(target) for target in targets]
+    }
+
+
+@router.get("/{script_id}/targets", response_model=List[ScriptTargetResponse], status_code=200)
+async def get_script_targets(
+    script_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    logger.info(f"Fetching publish targets for script ID {script_id} by {current_user.runner}")
+    targets = db.query(ScriptTarget).filter(ScriptTarget.script_id == script_id).order_by(ScriptTarget.server_id).all()
+    return [ScriptTargetResponse.model_validate(target) for target in targets]
+
+
+@router.get("/{script_id}/upload", response_model=ScriptDetails, status_code=200)
+async def get_script_upload(
+    script_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    logger.info(f"Fetching upload status for script ID {script_id} by {current_user.runner}")
+    script = db.query(Scripts).filter(Scripts.id == script_id).first()
+    if not script:
+        logger.error(f"Script with ID {script_id} not found")
+        raise HTTPException(status_code=404, detail="Script not found")
+    return ScriptDetails.model_validate(script)
+
+
 @router.get("/all", response_model=List[ScriptDetails], status_code=200)
 async def list_scripts(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
     logger.info(f"Listing scripts for user: {current_user.runner}")
@@ -128,6 +208,10 @@ async def list_scripts(db: Session = Depends(get_db), current_user: User = Depen
         name=script.name,
         description=script.description,
         upload_status=script.upload_status,
+        checksum=script.checksum,
+        bytes_sent=script.bytes_sent,
+        bytes_saved=script.bytes_saved,
+        transfers_skipped=script.transfers_skipped,
         file_name=script.file_name,
         file_path=script.file_path,
         hostname=script.hostname,
@@ -172,6 +256,7 @@ async def delete_script(script_id: int, db: Session = Depends(get_db), current_u
     if not script:
         logger.error(f"Script with ID {script_id} not found")
         raise HTTPException(status_code=404, detail="Script not found") 
+    notify_schedules_using(db, script_id=script_id, op="delete")
     db.delete(script)
     db.commit()
     logger.info(f"Script with ID {script_id} deleted successfully")
@@ -230,14 +315,15 @@ async def execute_script(
         username=server_info.username,
         command_description=script.description,
         command_status="queued",
-        runner=current_user.runner
+        runner=current_user.runner,
+        lane=INTERACTIVE_LANE
     )
     db.add(job)
     db.commit()
     db.refresh(job)
 
-    # Trigger Celery task (non-blocking)
-    task = run_script.delay(script.id, job.id)
+    # Trigger Celery task (non-blocking) on the interactive lane
+    task = enqueue_run(script.id, job.id, INTERACTIVE_LANE)
 
     logger.info(f"Job {job.id} queued via Celery with task ID: {task.id}")
     
@@ -293,10 +379,8 @@ async def upload_and_run_script(
         logger.error(f"Error executing uploaded script {upload_response['script_id']}: {err}")
         job.command_status = "failed"
         db.commit() 
-        job_output = JobOutput(
-            job_id=job.id,
-            stderr=err
-        )
+        job_output = JobOutput(job_id=job.id)
+        store_output(db, job_output, out, err)
         db.add(job_output)
         db.commit()
         db.refresh(job_output)  
@@ -320,11 +404,8 @@ async def upload_and_run_script(
         db.commit()
         
     
-    job_output = JobOutput(
-        job_id=job.id,
-        stdout=out,
-        stderr=err
-    )
+    job_output = JobOutput(job_id=job.id)
+    store_output(db, job_output, out, err)
     
     db.add(job_output)
     db.commit()
@@ -378,6 +459,7 @@ async def update_script(
     script.username = req.username
     script.runner = current_user.runner
     script.tags = req.tags
+    notify_schedules_using(db, script_id=script.id)
 
     db.commit()
     db.refresh(script)
@@ -420,6 +502,24 @@ async def get_runner_history(
 
 
 
+def _dispatch_one_time_run(db: Session, scheduled_job: ScheduleJob, previous_task_id: str = None):
+    try:
+        send_one_time_run(scheduled_job, previous_task_id)
+    except Exception as e:
+        # Leave it unarmed; the scheduler re-arms one-time runs without a task on its next sync
+        logger.error(f"Could not hand one-time schedule {scheduled_job.id} to Celery: {e}")
+        scheduled_job.eta_task_id = None
+        db.commit()
+
+
+def _check_spread(cron_expression: str, spread_seconds: int):
+    # A spread as long as the interval would push every run past the next slot
+    interval = cron_min_interval(cron_expression) if cron_expression and spread_seconds else None
+    if interval and spread_seconds >= interval:
+        logger.error(f"spread_seconds {spread_seconds} is not shorter than the {interval}s interval of '{cron_expression}'")
+        raise HTTPException(status_code=422, detail=f"spread_seconds must be less than the cron interval ({interval}s)")
+
+
 @router.post("/schedule", response_model=ScheduleJobResponse, status_code=201)
 async def schedule_job(
     req: ScheduleJobRequest,
@@ -436,18 +536,26 @@ async def schedule_job(
     if not script:
         logger.error(f"Job with ID {req.script_id} not found")
         raise HTTPException(status_code=404, detail="Job not found")
+    _check_spread(req.cron_expression, req.spread_seconds)
 
     scheduled_job = ScheduleJob(
         script_id=script.id,
         cron_expression=req.cron_expression,
         one_time_run=req.one_time_run,
         timezone=req.timezone,
-        is_active=req.is_active
+        is_active=req.is_active,
+        spread_seconds=req.spread_seconds,
+        misfire_policy=req.misfire_policy,
+        misfire_limit=req.misfire_limit
     )
 
     db.add(scheduled_job)
+    db.flush()
+    previous_task_id = prepare_one_time_run(scheduled_job)
+    notify_schedule_change(db, scheduled_job.id)
     db.commit()
     db.refresh(scheduled_job)
+    _dispatch_one_time_run(db, scheduled_job, previous_task_id)
 
     logger.info(f"Job scheduled successfully with ID: {scheduled_job.id}")
 
@@ -489,12 +597,19 @@ async def get_shceduled_job(
     if not job:
         logger.error(f"There are no scheduled job with id {scheduled_job_id}")
         raise HTTPException(status_code=404, detail="Job not found")
+    _check_spread(req.cron_expression, req.spread_seconds)
     
     job.cron_expression = req.cron_expression
     job.one_time_run = req.one_time_run
     job.is_active = req.is_active
+    job.spread_seconds = req.spread_seconds
+    job.misfire_policy = req.misfire_policy
+    job.misfire_limit = req.misfire_limit
+    previous_task_id = prepare_one_time_run(job)
+    notify_schedule_change(db, job.id)
     db.commit()
     db.refresh(job)
+    _dispatch_one_time_run(db, job, previous_task_id)
 
 
     logger.info(f"Scheduled Job edited successfully for Schdued Job ID: {scheduled_job_id} by user: {current_user.runner}")
@@ -522,8 +637,12 @@ async def get_shceduled_job(
         logger.error(f"There are no scheduled job with id {scheduled_job_id}")
         raise HTTPException(status_code=404, detail="Job not found")
     
+    eta_task_id = job.eta_task_id
     db.delete(job)
+    notify_schedule_change(db, scheduled_job_id, op="delete")
     db.commit()
+    if eta_task_id:
+        revoke_one_time_run(eta_task_id)
 
     logger.info(f"Scheduled Job deleted successfully for Schdued Job ID: {scheduled_job_id} by user: {current_user.runner}")
     
@@ -1,5 +1,5 @@
 from fastapi import FastAPI, HTTPException, APIRouter, Depends
-from schemas import  ServerAddRequest, ServerAddResponse, SerevrEdit, ServerEditResponse
+from schemas import  ServerAddRequest, ServerAddResponse, SerevrEdit, ServerEditResponse, HostStateResponse
 from sqlalchemy.orm import Session  
 from db_stuffs.database import get_db
 from db_stuffs.models import   Server# Import Job model if needed for database operations
@@ -10,6 +10,8 @@ from logger import logger  # ✅ Import centralized logger
 from oauth import get_current_user
 from db_stuffs import models
 from typing import List 
+from circuit_breaker import circuit_breaker
+from schedule_events import notify_schedules_using
 
 
 router = APIRouter(
@@ -57,7 +59,8 @@ async def server_list(db: Session = Depends(get_db), current_user = Depends(get_
         raise HTTPException(status_code=403, detail="Not authorized to list servers") 
     
     servers = db.query(Server).all()
-    return [ServerAddResponse.from_orm(server) for server in servers]
+    states = circuit_breaker.states([(server.hostname, server.port) for server in servers])
+    return [_with_state(server, states[(server.hostname, server.port or 22)]) for server in servers]
 
 
 @router.put("/edit/{server_id}", response_model=ServerEditResponse, status_code=201)
@@ -72,6 +75,7 @@ async def server_edit(server_id: int, req: SerevrEdit, db: Session = Depends(get
     server.owner_id = req.owner_id
     server.port = req.port
     server.tags = req.tags
+    notify_schedules_using(db, server_id=server_id)
     db.commit()
     db.refresh(server)
 
@@ -88,6 +92,7 @@ async def server_delete(server_id: int, db: Session = Depends(get_db), current_u
         logger.error(f"Server with ID: {server_id} not found")
         raise HTTPException(status_code=404, detail="Server not found")
     
+    notify_schedules_using(db, server_id=server_id, op="delete")
     db.delete(server)
     db.commit()
     logger.info(f"Server with ID: {server_id} deleted successfully")
@@ -104,6 +109,45 @@ async def server_get(server_id: int, db: Session = Depends(get_db), current_user
         raise HTTPException(status_code=404, detail="Server not found")
     
     logger.info(f"Server with ID: {server_id} retrieved successfully")
-    return ServerAddResponse.from_orm(server)
+    return _with_state(server, circuit_breaker.state(server.hostname, server.port))
+
+
+@router.get("/{server_id}/state", response_model=HostStateResponse)
+async def server_state(server_id: int, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
+    logger.info(f"Recived request to get reachability of server {server_id} from runner {current_user.runner}")
+
+    server = db.query(Server).filter(Server.id == server_id).first()
+    if not server:
+        logger.error(f"Server with ID: {server_id} not found")
+        raise HTTPException(status_code=404, detail="Server not found")
+
+    state = circuit_breaker.state(server.hostname, server.port)
+    return HostStateResponse(server_id=server.id, hostname=server.hostname, port=server.port or 22, **state)
+
+
+@router.post("/{server_id}/state/reset", response_model=HostStateResponse)
+async def server_state_reset(server_id: int, db: Session = Depends(get_db), current_user = Depends(get_current_user)):
+    logger.info(f"Recived request to reset circuit of server {server_id} from runner {current_user.runner}")
+
+    if not current_user.is_superuser:
+        logger.error("User is not authorized to reset server state.")
+        raise HTTPException(status_code=403, detail="Not authorized to reset server state")
+
+    server = db.query(Server).filter(Server.id == server_id).first()
+    if not server:
+        logger.error(f"Server with ID: {server_id} not found")
+        raise HTTPException(status_code=404, detail="Server not found")
+
+    if not circuit_breaker.reset(server.hostname, server.port):
+        raise HTTPException(status_code=503, detail="Circuit breaker state is unavailable")
+    logger.info(f"Circuit for server {server.hostname} reset")
+    state = circuit_breaker.state(server.hostname, server.port)
+    return HostStateResponse(server_id=server.id, hostname=server.hostname, port=server.port or 22, **state)
+
+
+def _with_state(server: Server, state: dict):
+    response = ServerAddResponse.from_orm(server)
+    response.circuit_state = state["state"]
+    return response
     
 
@@ -0,0 +1,37 @@
+import json
+
+from sqlalchemy import Text, cast, func, select, text
+from sqlalchemy.orm import Session
+
+from db_stuffs.models import ScheduleJob, Scripts
+
+
+SCHEDULE_CHANNEL = "schedule_changes"
+
+
+def notify_schedule_change(db: Session, schedule_id: int, op: str = "upsert"):
+    """Tell the scheduler a schedule changed.
+
+    pg_notify is transactional: the notification is only delivered when the
+    caller's transaction commits, and dropped if it rolls back.
+    """
+    db.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": SCHEDULE_CHANNEL, "payload": json.dumps({"id": schedule_id, "op": op})},
+    )
+
+
+def notify_schedules_using(db: Session, script_id: int = None, server_id: int = None, op: str = "upsert"):
+    """notify_schedule_change for every schedule of a script, or of any script on a server.
+
+    The scheduler keeps its own copy of the script and server fields, so
+    edits to either must reach it like schedule edits. Call before deleting
+    the rows, in the same transaction.
+    """
+    payload = cast(func.json_build_object("id", ScheduleJob.id, "op", op), Text)
+    query = select(func.pg_notify(SCHEDULE_CHANNEL, payload))
+    if script_id is not None:
+        query = query.where(ScheduleJob.script_id == script_id)
+    if server_id is not None:
+        query = query.join(Scripts, ScheduleJob.script_id == Scripts.id).where(Scripts.server_id == server_id)
+    db.execute(query)
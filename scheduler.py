@@ -1,71 +1,803 @@
 import asyncio
-from datetime import datetime
-from croniter import croniter
+import heapq
+import itertools
+import json
+import os
+import socket
+import uuid
+import time
+import zlib
+from bisect import bisect_right
+from collections import Counter, defaultdict
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+from typing import Optional
+import psycopg
 import pytz
-from datetime import timedelta
-from db_stuffs.models import ScheduleJob, Scripts, Job
-from db_stuffs.database import SessionLocal
-from tasks import run_script
+from sqlalchemy import func, and_, or_, update, true, values, column, Integer, DateTime
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from cron_utils import schedule_timezone, as_utc, next_cron_fire, last_cron_fires, iter_cron_fires, cron_min_interval
+from db_stuffs.models import ScheduleJob, Scripts, Job, Server, SchedulerMember, UpcomingRun
+from db_stuffs.database import SessionLocal, SQLALCHEMY_DATABASE_URL
+from tasks import enqueue_run, enqueue_batch, prepare_one_time_run, send_one_time_run
+from celery_worker import SCHEDULED_LANE, BULK_LANE
 from logger import logger
+from schedule_events import SCHEDULE_CHANNEL
+from scheduler_metrics import scheduler_metrics
+from config import settings
 
 
-CHECK_INTERVAL = 30  # seconds
+CHECK_INTERVAL = 30  # seconds between syncs with the schedule_jobs table
+SYNC_OVERLAP = 60  # seconds re-read before the last seen updated_at
+SCHEDULER_LOCK_ID = 4_242_001  # pg advisory lock key for scheduler leadership
+LEADER_RETRY_INTERVAL = 5  # seconds between leadership attempts on standby instances
+MEMBER_HEARTBEAT = 5  # seconds between membership heartbeats when sharded
+MEMBER_TTL = 15  # seconds without a heartbeat before a member is dropped
+FALLBACK_SYNC_INTERVAL = 300  # seconds between safety-net syncs while change notifications are flowing
+FIRE_RETRY_DELAY = 1  # seconds before due schedules are retried after a failed fire, doubled per failure
+FIRE_RETRY_MAX_DELAY = 30
 
 
-async def scheduler_loop():
-    while True:
-        now = datetime.now()
-        # logger.info("Running scheduler check")
+@dataclass(frozen=True)
+class ScheduleEntry:
+    """Plain snapshot of a ScheduleJob row with what is needed to fire it.
+
+    The script and server columns are captured at sync time so firing a
+    schedule needs no lookups.
+    """
+    id: int
+    script_id: int
+    cron_expression: Optional[str]
+    one_time_run: Optional[datetime]  # aware UTC
+    timezone: Optional[str]
+    last_run_at: Optional[datetime]  # aware UTC
+    file_name: str
+    description: Optional[str]
+    runner: str
+    server_id: int
+    hostname: str
+    username: str
+    key_path: str
+    spread: int = 0  # seconds
+    misfire_policy: str = "run_once"  # skip | run_once | run_all
+    misfire_limit: int = 1
+
+    @classmethod
+    def from_row(cls, sched: ScheduleJob, script: Scripts, server: Server):
+        tz = schedule_timezone(sched.timezone)
+        return cls(
+            id=sched.id,
+            script_id=sched.script_id,
+            cron_expression=sched.cron_expression,
+            one_time_run=as_utc(sched.one_time_run, tz),
+            timezone=sched.timezone,
+            last_run_at=as_utc(sched.last_run_at),
+            file_name=script.file_name,
+            description=script.description,
+            runner=script.runner,
+            server_id=server.id,
+            hostname=server.hostname,
+            username=server.username,
+            key_path=server.key_path,
+            spread=settings.SCHEDULE_DEFAULT_SPREAD if sched.spread_seconds is None else sched.spread_seconds,
+            misfire_policy=sched.misfire_policy or settings.SCHEDULE_MISFIRE_POLICY,
+            misfire_limit=sched.misfire_limit or settings.SCHEDULE_MISFIRE_MAX_RUNS,
+        )
+
+    def missed_slots(self, first_missed: datetime, now: datetime):
+        """Apply the misfire policy to a schedule that fell behind.
+
+        Returns the slot to fire next and the earlier missed slots to run
+        along with it.
+        """
+        if not self.cron_expression:
+            # A missed one-time run either still runs once or not at all
+            return (None if self.misfire_policy == "skip" else first_missed), []
+        tz = schedule_timezone(self.timezone)
+        if self.misfire_policy == "skip":
+            return next_cron_fire(self.cron_expression, tz, now), []
+        limit = self.misfire_limit if self.misfire_policy == "run_all" else 1
+        slots = last_cron_fires(self.cron_expression, tz, self.last_run_at or first_missed - timedelta(microseconds=1), now, limit)
+        return slots[-1], slots[:-1]
+
+    def next_fire(self, now: datetime):
+        """Next time this schedule is due, or None if it never fires again.
+
+        A time in the past means a run was missed and is due right away.
+        """
+        if self.one_time_run and not self.last_run_at:
+            return self.one_time_run
+        if self.cron_expression:
+            return next_cron_fire(self.cron_expression, schedule_timezone(self.timezone), self.last_run_at or now)
+        return None
+
+    def offset(self):
+        """Fixed delay within the spread window, derived from the schedule id.
+
+        Every schedule lands on the same offset each time, so schedules sharing
+        a cron expression are smeared evenly instead of firing together. The
+        window is kept shorter than the cron interval so a run never slides
+        past the next slot.
+        """
+        spread = self.spread
+        if spread > 0 and self.cron_expression:
+            interval = cron_min_interval(self.cron_expression)
+            if interval:
+                spread = min(spread, interval - 1)
+        if spread <= 0:
+            return timedelta(0)
+        return timedelta(seconds=zlib.crc32(str(self.id).encode()) % (spread + 1))
+
+def bucket_start(value: datetime, width: timedelta):
+    seconds = int(width.total_seconds())
+    return datetime.fromtimestamp(int(value.timestamp()) // seconds * seconds, pytz.UTC)
+
+
+def bucketed_runs(entries, start: datetime, end: datetime, width: timedelta):
+    """Planned runs (spread included) per (schedule id, bucket start) in (start, end].
+
+    Cron expressions are evaluated once per (expression, timezone) and shifted
+    by each schedule's spread offset, like simulate_schedules.py does, and
+    schedules on the same offset share the bucketing.
+    """
+    seconds = int(width.total_seconds())
+    lo, hi = int(start.timestamp()), int(end.timestamp())
+    runs = Counter()
+    groups = defaultdict(list)  # (cron, tz) -> [(schedule id, offset seconds)]
+    for entry in entries:
+        offset = entry.offset()
+        if entry.one_time_run and not entry.last_run_at and start < entry.one_time_run + offset <= end:
+            runs[entry.id, bucket_start(entry.one_time_run + offset, width)] += 1
+        if entry.cron_expression:
+            groups[entry.cron_expression, entry.timezone].append((entry.id, int(offset.total_seconds())))
+
+    for (cron, tz), members in groups.items():
+        max_offset = max(offset for _, offset in members)
+        base = [int(fire_at.timestamp()) for fire_at in iter_cron_fires(cron, schedule_timezone(tz), start - timedelta(seconds=max_offset), end)]
+        by_offset = {}  # offset -> [(bucket start, runs)]
+        for sched_id, offset in members:
+            buckets = by_offset.get(offset)
+            if buckets is None:
+                window = base[bisect_right(base, lo - offset):bisect_right(base, hi - offset)]
+                counts = Counter((ts + offset) // seconds * seconds for ts in window)
+                buckets = by_offset[offset] = [(datetime.fromtimestamp(ts, pytz.UTC), count) for ts, count in counts.items()]
+            for bucket, count in buckets:
+                runs[sched_id, bucket] += count
+    return runs
+
+
+@dataclass
+class IndexUpdate:
+    """What one update_index run works on, captured on the scheduler loop."""
+    now: datetime
+    until: datetime
+    indexed_until: Optional[datetime]  # None rebuilds the index from scratch
+    entries: dict  # schedule id -> ScheduleEntry
+    dirty: set
+
+
+class ScheduleHeap:
+    """Min-heap of (next fire time, schedule id) with lazy deletion.
+
+    Updating or removing a schedule just records its new fire time in
+    self._next; heap entries that no longer match are dropped when they
+    reach the top.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._next = {}  # schedule id -> fire time
+        self._seq = itertools.count()
+
+    def __len__(self):
+        return len(self._next)
+
+    def __contains__(self, sched_id):
+        return sched_id in self._next
+
+    def push(self, sched_id: int, fire_at: datetime):
+        self._next[sched_id] = fire_at
+        heapq.heappush(self._heap, (fire_at, next(self._seq), sched_id))
+        if len(self._heap) > 2 * len(self._next) + 64:
+            self._compact()
+
+    def remove(self, sched_id: int):
+        self._next.pop(sched_id, None)
+
+    def _compact(self):
+        self._heap = [item for item in self._heap if self._next.get(item[2]) == item[0]]
+        heapq.heapify(self._heap)
+
+    def _drop_stale(self):
+        while self._heap:
+            fire_at, _, sched_id = self._heap[0]
+            if self._next.get(sched_id) == fire_at:
+                return
+            heapq.heappop(self._heap)
+
+    def peek(self):
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: datetime):
+        due = []
+        while True:
+            self._drop_stale()
+            if not self._heap or self._heap[0][0] > now:
+                return due
+            fire_at, _, sched_id = heapq.heappop(self._heap)
+            del self._next[sched_id]
+            due.append((sched_id, fire_at))
+
+
+class Scheduler:
+    def __init__(self, shard=(0, 1)):
+        self.heap = ScheduleHeap()
+        self.entries = {}  # schedule id -> ScheduleEntry
+        self.watermark = None  # newest updated_at seen across schedules, scripts and servers
+        self.shard_index, self.shard_count = shard
+        self.slots = {}  # schedule id -> cron slot being waited for, recorded as last_run_at when it fires
+        self.missed = {}  # schedule id -> earlier missed slots replayed together with that slot
+        self._window = None  # current second for the fire-rate limits
+        self._window_fires = 0
+        self._host_fires = Counter()
+        self.stats = Counter()  # evaluated / enqueued / deferred / replayed / errors since the last drain
+        self.lags = []  # seconds each fired schedule ran after its planned time
+        self.index_until = None  # end of the window covered by upcoming_runs, None until first written
+        self.index_dirty = set()  # schedule ids whose upcoming_runs rows must be rewritten
+        self.fire_failures = 0  # consecutive failed fire_due commits, for the retry backoff
+
+    def _owned(self):
+        # Schedules are partitioned by id across the live scheduler instances
+        if self.shard_count <= 1:
+            return true()
+        return ScheduleJob.id % self.shard_count == self.shard_index
+
+    def _polled(self):
+        # Pure one-time schedules fire through Celery ETAs (tasks.fire_one_time_schedule)
+        return and_(self._owned(), ScheduleJob.cron_expression.isnot(None))
+
+    def _plan(self, entry: ScheduleEntry, now: datetime):
+        self.entries[entry.id] = entry
+        fire_at = entry.next_fire(now)
+        missed = []
+        if fire_at is not None and fire_at + entry.offset() + timedelta(seconds=settings.SCHEDULE_MISFIRE_GRACE) < now:
+            fire_at, missed = entry.missed_slots(fire_at, now)
+            logger.info(f"Schedule {entry.id} missed runs, {entry.misfire_policy} policy: next slot {fire_at}, {len(missed)} extra runs")
+        if missed:
+            self.missed[entry.id] = missed
+        else:
+            self.missed.pop(entry.id, None)
+        if fire_at is None:
+            self.slots.pop(entry.id, None)
+            self.heap.remove(entry.id)
+        else:
+            self.slots[entry.id] = fire_at
+            self.heap.push(entry.id, fire_at + entry.offset())
+
+    def _forget(self, sched_id: int):
+        self.index_dirty.add(sched_id)
+        self.entries.pop(sched_id, None)
+        self.slots.pop(sched_id, None)
+        self.missed.pop(sched_id, None)
+        self.heap.remove(sched_id)
+
+    def _query(self, db):
+        # One joined query instead of a script lookup per schedule
+        return (
+            db.query(ScheduleJob, Scripts, Server)
+            .join(Scripts, ScheduleJob.script_id == Scripts.id)
+            .join(Server, Scripts.server_id == Server.id)
+            .filter(self._polled())
+        )
+
+    def _apply(self, rows, now: datetime):
+        for sched, script, server in rows:
+            for updated_at in (sched.updated_at, script.updated_at, server.updated_at):
+                if updated_at and (self.watermark is None or updated_at > self.watermark):
+                    self.watermark = updated_at
+            if not sched.is_active:
+                self._forget(sched.id)
+                continue
+            entry = ScheduleEntry.from_row(sched, script, server)
+            if self.entries.get(entry.id) != entry or entry.id not in self.heap:
+                self.index_dirty.add(entry.id)
+                self._plan(entry, now)
+
+    def sync(self, db, now: datetime):
+        """Reconcile in-memory state with the DB.
+
+        The first call loads every active schedule; after that only rows
+        whose schedule, script or server changed since the last sync are
+        fetched. Hard deletes don't bump updated_at, so the active count is
+        compared and the id set reconciled only when it disagrees.
+        """
+        if self.watermark is None:
+            rows = self._query(db).filter(ScheduleJob.is_active.is_(True)).all()
+            self._apply(rows, now)
+            logger.info(f"Scheduler loaded {len(rows)} active schedules (shard {self.shard_index + 1}/{self.shard_count})")
+            self.arm_one_time_runs(db)
+            return
+
+        # Re-read a little before the watermark: now() is the transaction start,
+        # so a slow transaction can commit a row stamped earlier than rows we saw.
+        since = self.watermark - timedelta(seconds=SYNC_OVERLAP)
+        rows = self._query(db).filter(or_(
+            ScheduleJob.updated_at > since,
+            Scripts.updated_at > since,
+            Server.updated_at > since,
+        )).all()
+        self._apply(rows, now)
+
+        active = db.query(func.count(ScheduleJob.id)).filter(ScheduleJob.is_active.is_(True), self._polled()).scalar()
+        if active != len(self.entries):
+            ids = {row[0] for row in db.query(ScheduleJob.id).filter(ScheduleJob.is_active.is_(True), self._polled())}
+            for sched_id in set(self.entries) - ids:
+                self._forget(sched_id)
+            missing = ids - set(self.entries)
+            if missing:
+                self._apply(self._query(db).filter(ScheduleJob.id.in_(missing)).all(), now)
+
+        self.arm_one_time_runs(db)
+
+    def arm_one_time_runs(self, db):
+        """Hand pending one-time schedules without an ETA task to Celery.
+
+        Covers schedules created before ETAs were used and ones whose
+        dispatch failed when they were saved.
+        """
+        pending = db.query(ScheduleJob).filter(
+            self._owned(),
+            ScheduleJob.is_active.is_(True),
+            ScheduleJob.one_time_run.isnot(None),
+            ScheduleJob.cron_expression.is_(None),
+            ScheduleJob.last_run_at.is_(None),
+            ScheduleJob.eta_task_id.is_(None),
+        ).all()
+        if not pending:
+            return
+        for sched in pending:
+            prepare_one_time_run(sched)
+        db.commit()
+        for sched in pending:
+            try:
+                send_one_time_run(sched)
+            except Exception as e:
+                logger.error(f"Could not hand one-time schedule {sched.id} to Celery: {e}")
+                db.query(ScheduleJob).filter(ScheduleJob.id == sched.id).update({ScheduleJob.eta_task_id: None}, synchronize_session=False)
+                db.commit()
+        logger.info(f"Armed {len(pending)} one-time schedules with Celery ETAs")
+
+    def refresh(self, db, sched_ids, now: datetime):
+        """Apply just the given schedules, e.g. after a change notification."""
+        rows = self._query(db).filter(ScheduleJob.id.in_(sched_ids)).all()
+        self._apply(rows, now)
+        # Deleted, no longer in our shard, or pointing at a deleted script
+        for sched_id in set(sched_ids) - {sched.id for sched, _, _ in rows}:
+            self._forget(sched_id)
+
+    def index_update(self, now: datetime):
+        """Snapshot the work for update_index, or None if the index is current.
+
+        Taken on the scheduler loop so update_index can run in another thread
+        while schedules keep firing. Dirty ids are handed over here; a failed
+        update puts them back.
+        """
+        if settings.UPCOMING_HORIZON_HOURS <= 0:
+            return None
+        width = timedelta(minutes=settings.UPCOMING_BUCKET_MINUTES)
+        until = bucket_start(now + timedelta(hours=settings.UPCOMING_HORIZON_HOURS), width)
+        if self.index_until is not None and not self.index_dirty and until <= self.index_until:
+            return None
+        dirty, self.index_dirty = (set(self.entries) if self.index_until is None else self.index_dirty), set()
+        return IndexUpdate(now, until, self.index_until, dict(self.entries), dirty)
+
+    def update_index(self, db, work: IndexUpdate):
+        """Maintain upcoming_runs for the schedules this instance owns.
+
+        Only changed schedules are rewritten. The window slides forward one
+        bucket at a time, and only the new tail is evaluated.
+        """
+        try:
+            width = timedelta(minutes=settings.UPCOMING_BUCKET_MINUTES)
+            owned = true() if self.shard_count <= 1 else UpcomingRun.schedule_id % self.shard_count == self.shard_index
+            until, entries = work.until, work.entries
+
+            if work.indexed_until is None:
+                db.query(UpcomingRun).filter(owned).delete(synchronize_session=False)
+                indexed_until = until
+            else:
+                indexed_until = work.indexed_until
+                ids = sorted(work.dirty)
+                for i in range(0, len(ids), 1000):
+                    db.query(UpcomingRun).filter(UpcomingRun.schedule_id.in_(ids[i:i + 1000])).delete(synchronize_session=False)
+
+            # (schedule id, bucket start) -> runs
+            runs = bucketed_runs([entries[i] for i in work.dirty if i in entries], work.now, indexed_until, width)
+            if until > indexed_until:
+                runs.update(bucketed_runs(entries.values(), indexed_until, until, width))
+                db.query(UpcomingRun).filter(owned, UpcomingRun.bucket_start < bucket_start(work.now, width)).delete(synchronize_session=False)
+
+            rows = [
+                {"schedule_id": sched_id, "bucket_start": start, "server_id": entries[sched_id].server_id, "runs": count}
+                for (sched_id, start), count in runs.items()
+            ]
+            for i in range(0, len(rows), 5000):
+                stmt = pg_insert(UpcomingRun).values(rows[i:i + 5000])
+                db.execute(stmt.on_conflict_do_update(
+                    index_elements=["schedule_id", "bucket_start"],
+                    set_={"runs": UpcomingRun.runs + stmt.excluded.runs},
+                ))
+            db.commit()
+        except Exception:
+            self.index_dirty |= work.dirty
+            raise
+        self.index_until = max(until, indexed_until)
+
+    def drain_stats(self):
+        stats, lags = self.stats, self.lags
+        self.stats, self.lags = Counter(), []
+        return stats, lags
+
+    def seconds_until_next(self, now: datetime):
+        fire_at = self.heap.peek()
+        if fire_at is None:
+            return None
+        return max(0.0, (fire_at - now).total_seconds())
+
+    def _admit(self, due, now: datetime):
+        """Split due schedules into those that may fire now and those deferred.
+
+        At most SCHEDULER_MAX_FIRES_PER_SECOND schedules fire per second overall
+        and SCHEDULER_HOST_FIRES_PER_SECOND per server; the rest wait for the
+        next second, keeping their place in line. A schedule replaying missed
+        runs counts once per run, but always goes out if it is first in its second.
+        """
+        second = int(now.timestamp())
+        if second != self._window:
+            self._window, self._window_fires, self._host_fires = second, 0, Counter()
+
+        max_fires = settings.SCHEDULER_MAX_FIRES_PER_SECOND
+        host_fires = settings.SCHEDULER_HOST_FIRES_PER_SECOND
+        admitted, deferred = [], []
+        for item in due:
+            entry = item[0]
+            runs = 1 + len(self.missed.get(entry.id, ()))
+            host_count = self._host_fires[entry.server_id]
+            if (max_fires and self._window_fires and self._window_fires + runs > max_fires) or \
+                    (host_fires and host_count and host_count + runs > host_fires):
+                deferred.append(item)
+                continue
+            self._window_fires += runs
+            self._host_fires[entry.server_id] += runs
+            admitted.append(item)
+        return admitted, deferred
+
+    def fire_due(self, now: datetime):
+        # (entry, cron slot, fire time after spread)
+        due = [
+            (self.entries[sched_id], self.slots[sched_id], fire_at)
+            for sched_id, fire_at in self.heap.pop_due(now)
+            if sched_id in self.entries
+        ]
+        self.stats["evaluated"] += len(due)
+        due, deferred = self._admit(due, now)
+        self.stats["deferred"] += len(deferred)
+        if deferred:
+            retry_at = datetime.fromtimestamp(int(now.timestamp()) + 1, pytz.UTC)
+            for entry, _, _ in deferred:
+                self.heap.push(entry.id, retry_at)
+            logger.info(f"Deferred {len(deferred)} due schedules to {retry_at} by fire-rate limits")
+        if not due:
+            return 0
+
+        try:
+            with SessionLocal() as db:
+                # Claim the slots in one UPDATE first. A slot already recorded by
+                # another instance (e.g. mid-rebalance or leader failover) is
+                # not returned, so it can never fire twice.
+                slots = values(column("id", Integer), column("fire_at", DateTime), name="slots").data(
+                    [(entry.id, slot.replace(tzinfo=None)) for entry, slot, _ in due]
+                )
+                claimed = set(db.scalars(
+                    update(ScheduleJob)
+                    .where(ScheduleJob.id == slots.c.id)
+                    .where(or_(ScheduleJob.last_run_at.is_(None), ScheduleJob.last_run_at < slots.c.fire_at))
+                    .values(last_run_at=slots.c.fire_at)
+                    .returning(ScheduleJob.id),
+                    execution_options={"synchronize_session": False},
+                ).all())
+
+                # Missed runs being replayed go to the bulk lane
+                fired = [
+                    (entry, BULK_LANE if replay else SCHEDULED_LANE)
+                    for entry, _, _ in due if entry.id in claimed
+                    for replay in range(1 + len(self.missed.get(entry.id, ())))
+                ]
+                jobs = [_new_job(entry, lane) for entry, lane in fired]
+                db.add_all(jobs)
+                db.flush()
+                runs = [(entry.server_id, entry.script_id, job.id, lane) for (entry, lane), job in zip(fired, jobs)]
+                # One commit for everything due this tick
+                db.commit()
+        except Exception as e:
+            logger.error(f"Error scheduling jobs: {e}", exc_info=True)
+            self.stats["errors"] += 1
+            # Put them back with a growing delay so a database outage doesn't spin the loop
+            self.fire_failures += 1
+            delay = min(FIRE_RETRY_DELAY * 2 ** min(self.fire_failures - 1, 10), FIRE_RETRY_MAX_DELAY)
+            retry_at = now + timedelta(seconds=delay)
+            for entry, _, _ in due:
+                self.heap.push(entry.id, retry_at)
+            return 0
+        self.fire_failures = 0
+
+        # Enqueue only after commit so the workers can see the Job rows
+        by_host = defaultdict(list)
+        for server_id, script_id, job_id, lane in runs:
+            by_host[server_id, lane].append((script_id, job_id))
+        for (server_id, lane), host_runs in by_host.items():
+            # Several runs for one server share a task, a DB session and an SSH connection
+            if settings.SCHEDULER_BATCH_MIN_RUNS and len(host_runs) >= settings.SCHEDULER_BATCH_MIN_RUNS:
+                enqueue_batch(server_id, [job_id for _, job_id in host_runs], lane)
+            else:
+                for script_id, job_id in host_runs:
+                    enqueue_run(script_id, job_id, lane)
+        enqueued_at = datetime.now(pytz.UTC)
+        self.stats["enqueued"] += len(runs)
+        self.stats["replayed"] += len(runs) - len(claimed)
+        # From the planned time: the heap key moves on rate-limit deferrals and retries
+        self.lags.extend((enqueued_at - slot - entry.offset()).total_seconds() for entry, slot, _ in due if entry.id in claimed)
+        for entry, slot, _ in due:
+            self._plan(replace(entry, last_run_at=slot), now)
+
+        logger.info(f"Scheduled {len(runs)} jobs at {now}")
+        logger.debug(f"Runs scheduled at {now}: {runs}")
+        return len(runs)
+
+
+def _new_job(entry: ScheduleEntry, lane: str = SCHEDULED_LANE):
+    return Job(
+        command=f"bash /home/{entry.username}/bin/{entry.file_name}",
+        hostname=entry.hostname,
+        server_id=entry.server_id,
+        key_path=entry.key_path,
+        job_id=entry.script_id,
+        username=entry.username,
+        command_description=entry.description,
+        command_status="queued",
+        runner=entry.runner,
+        lane=lane
+    )
+
+
+class LeaderLock:
+    """Postgres session-level advisory lock held on a dedicated connection.
+
+    Only the instance holding the lock drives scheduling. If the leader dies
+    its connection closes and Postgres releases the lock; TCP keepalives make
+    sure that also happens when the host vanishes without closing the socket.
+    """
+
+    def __init__(self, lock_id: int = SCHEDULER_LOCK_ID):
+        self.lock_id = lock_id
+        self._conn = None
+
+    async def acquire(self) -> bool:
+        if self._conn is None or self._conn.closed:
+            self._conn = await psycopg.AsyncConnection.connect(
+                SQLALCHEMY_DATABASE_URL, autocommit=True,
+                keepalives=1, keepalives_idle=10, keepalives_interval=5, keepalives_count=3,
+            )
+        cur = await self._conn.execute("SELECT pg_try_advisory_lock(%s)", (self.lock_id,))
+        return (await cur.fetchone())[0]
+
+    async def still_held(self) -> bool:
+        # The lock lives exactly as long as the session, so a live connection means we hold it
+        try:
+            await self._conn.execute("SELECT 1")
+            return True
+        except Exception as e:
+            logger.error(f"Lost scheduler leadership connection: {e}")
+            return False
+
+    async def release(self):
+        if self._conn is not None and not self._conn.closed:
+            await self._conn.close()
+        self._conn = None
+
+
+class Membership:
+    """Heartbeat row in scheduler_members used to shard schedules.
+
+    Every sharded instance upserts its heartbeat and reads the list of live
+    members; its position in that sorted list is its shard index. Members
+    that stop heartbeating drop out after MEMBER_TTL and the rest rebalance.
+    """
+
+    def __init__(self):
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def heartbeat(self):
+        with SessionLocal() as db:
+            db.execute(
+                pg_insert(SchedulerMember)
+                .values(instance_id=self.instance_id, heartbeat_at=func.now())
+                .on_conflict_do_update(index_elements=["instance_id"], set_={"heartbeat_at": func.now()})
+            )
+            cutoff = func.now() - timedelta(seconds=MEMBER_TTL)
+            members = [row[0] for row in db.query(SchedulerMember.instance_id).filter(SchedulerMember.heartbeat_at > cutoff).order_by(SchedulerMember.instance_id)]
+            db.query(SchedulerMember).filter(SchedulerMember.heartbeat_at < func.now() - timedelta(seconds=MEMBER_TTL * 4)).delete(synchronize_session=False)
+            db.commit()
+        return members.index(self.instance_id), len(members)
+
+    def leave(self):
         with SessionLocal() as db:
-            schedules = db.query(ScheduleJob).filter_by(is_active=True).all()
-
-            for sched in schedules:
-                job = db.query(Scripts).filter_by(id=sched.script_id).first()
-                if not job:
-                    continue
-                
-                # Check if it's a one-time run
-                if sched.one_time_run and not sched.last_run_at:
-                    if sched.one_time_run and now >= sched.one_time_run.replace(tzinfo=None):
-                        run_script.delay(script_id=job.job_id, job_id=job.id)
-                        sched.last_run_at = now
-                        db.commit()
-                        logger.info(f"Committed run at {now}")
-
-
-                # Or if it's a recurring job
-                elif sched.cron_expression:
-                    try:
-                        # Use timezone or default to UTC
-                        tz = pytz.timezone(sched.timezone) if sched.timezone else pytz.UTC
-                        now_tz = datetime.now(tz)
-                        #logger.info(f"Now_tz = {now_tz}")
-
-                        #last_run = sched.last_run_at or now_tz - timedelta(seconds=CHECK_INTERVAL)
-                        last_run = sched.last_run_at.astimezone(tz) if sched.last_run_at else now_tz - timedelta(seconds=CHECK_INTERVAL)
-                        #logger.info(f"Last_run = {last_run}")
-                        
-                        # Ensure last_run is also timezone-aware
-                        if last_run.tzinfo is None:
-                            last_run = tz.localize(last_run)
-
-                        next_run = croniter(sched.cron_expression, last_run).get_next(datetime)
-                        #logger.info(f"Next_tz = {next_run}")
-
-                        if last_run < next_run <= now_tz:
-                            run_script.delay(script_id=job.id, job_id=job.id)
-                            sched.last_run_at = now_tz.astimezone(pytz.UTC)
-                            #logger.info(f"This time = {sched.last_run_at}")
-                            #logger.info(f"Now_tz = {now_tz}")
-                            db.commit()
-                            logger.info(f"Scheduled job triggered at {now_tz} for script ID {job.id}")
-
-
-                        # logger.info(f"datetime.now() = {datetime.now()}")  # naive
-                        # logger.info(f"datetime.now(tz) = {datetime.now(tz)}")  # aware
-                        # logger.info(f"tz.localize(datetime.now()) = {tz.localize(datetime.now())}") 
-
-                    except Exception as e:
-                        logger.error(f"Error scheduling job: {e}", exc_info=True)
-
-        await asyncio.sleep(CHECK_INTERVAL)
+            db.query(SchedulerMember).filter(SchedulerMember.instance_id == self.instance_id).delete(synchronize_session=False)
+            db.commit()
+
+
+class ChangeListener:
+    """LISTENs for schedule change notifications and collects changed ids."""
+
+    def __init__(self):
+        self.changed = set()
+        self.wake = asyncio.Event()
+        self.connected = False
+        self.needs_sync = False  # notifications may have been missed while disconnected
+
+    async def run(self):
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(SQLALCHEMY_DATABASE_URL, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {SCHEDULE_CHANNEL}")
+                    self.connected = True
+                    self.needs_sync = True
+                    self.wake.set()
+                    logger.info(f"Listening for schedule changes on {SCHEDULE_CHANNEL}")
+                    async for notify in conn.notifies():
+                        try:
+                            self.changed.add(int(json.loads(notify.payload)["id"]))
+                        except (ValueError, KeyError, TypeError):
+                            logger.warning(f"Ignoring malformed schedule notification: {notify.payload}")
+                        self.wake.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Schedule change listener failed: {e}")
+            finally:
+                self.connected = False
+            await asyncio.sleep(LEADER_RETRY_INTERVAL)
+
+    def take(self):
+        changed, self.changed = self.changed, set()
+        self.wake.clear()
+        return changed
+
+
+async def _update_index(scheduler: Scheduler, work: IndexUpdate):
+    def update():
+        with SessionLocal() as db:
+            scheduler.update_index(db, work)
+    started = time.monotonic()
+    try:
+        await asyncio.to_thread(update)
+    except Exception as e:
+        logger.error(f"Upcoming runs index update failed: {e}", exc_info=True)
+        return
+    if work.indexed_until is None:
+        logger.info(f"Rebuilt upcoming runs index for {len(work.entries)} schedules in {time.monotonic() - started:.1f}s")
+
+
+async def _lead(lock: LeaderLock = None, membership: Membership = None):
+    scheduler = None
+    shard = (0, 1)
+    last_sync = last_beat = None
+    index_task = None  # upcoming_runs maintenance, kept off the firing path
+    listener = ChangeListener()
+    listener_task = asyncio.create_task(listener.run())
+
+    try:
+        while lock is None or await lock.still_held():
+            tick_started = time.monotonic()
+            tick_errors = 0
+            try:
+                if membership and (last_beat is None or time.monotonic() - last_beat >= MEMBER_HEARTBEAT):
+                    new_shard = await asyncio.to_thread(membership.heartbeat)
+                    last_beat = time.monotonic()
+                    if new_shard != shard:
+                        logger.info(f"Scheduler membership changed, now shard {new_shard[0] + 1}/{new_shard[1]}")
+                        shard, scheduler = new_shard, None
+
+                if scheduler is None:
+                    scheduler = Scheduler(shard)
+                    last_sync = None
+
+                changed = listener.take()
+                if listener.needs_sync:
+                    listener.needs_sync = False
+                    last_sync = None
+
+                # Notifications carry edits immediately; the periodic sync is only
+                # a safety net, and runs more often while the listener is down.
+                sync_interval = FALLBACK_SYNC_INTERVAL if listener.connected else CHECK_INTERVAL
+                if last_sync is None or time.monotonic() - last_sync >= sync_interval:
+                    def sync():
+                        with SessionLocal() as db:
+                            scheduler.sync(db, datetime.now(pytz.UTC))
+                    await asyncio.to_thread(sync)
+                    last_sync = time.monotonic()
+                    logger.info(f"Scheduler synced, {len(scheduler.heap)} schedules pending")
+                elif changed:
+                    def refresh():
+                        with SessionLocal() as db:
+                            scheduler.refresh(db, changed, datetime.now(pytz.UTC))
+                    await asyncio.to_thread(refresh)
+                    logger.info(f"Applied changes to schedules {sorted(changed)}")
+
+                await asyncio.to_thread(scheduler.fire_due, datetime.now(pytz.UTC))
+
+                # One index update at a time, across scheduler rebuilds too
+                if index_task is None or index_task.done():
+                    work = scheduler.index_update(datetime.now(pytz.UTC))
+                    if work:
+                        index_task = asyncio.create_task(_update_index(scheduler, work))
+            except Exception as e:
+                logger.error(f"Scheduler tick failed: {e}", exc_info=True)
+                tick_errors = 1
+
+            stats, lags = scheduler.drain_stats() if scheduler else (Counter(), [])
+            stats["errors"] += tick_errors
+            await asyncio.to_thread(
+                scheduler_metrics.record_tick, time.monotonic() - tick_started, lags,
+                len(scheduler.heap) if scheduler else 0, **stats,
+            )
+
+            # Sleep until the earliest due schedule, the next sync or heartbeat, or a change notification
+            sync_interval = FALLBACK_SYNC_INTERVAL if listener.connected else CHECK_INTERVAL
+            delay = sync_interval - (time.monotonic() - last_sync) if last_sync else CHECK_INTERVAL
+            if membership:
+                delay = min(delay, MEMBER_HEARTBEAT - (time.monotonic() - last_beat) if last_beat else MEMBER_HEARTBEAT)
+            until_next = scheduler.seconds_until_next(datetime.now(pytz.UTC)) if scheduler else None
+            if until_next is not None:
+                delay = min(delay, until_next)
+            try:
+                await asyncio.wait_for(listener.wake.wait(), timeout=max(delay, 0.01))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        listener_task.cancel()
+
+
+async def scheduler_loop():
+    if settings.SCHEDULER_SHARDING:
+        # Every instance schedules its own partition; no leader needed
+        membership = Membership()
+        logger.info(f"Starting sharded scheduler instance {membership.instance_id}")
+        try:
+            await _lead(membership=membership)
+        finally:
+            await asyncio.to_thread(membership.leave)
+        return
+
+    lock = LeaderLock()
+    try:
+        while True:
+            try:
+                if await lock.acquire():
+                    logger.info("Acquired scheduler leadership")
+                    await _lead(lock)
+                    logger.warning("Stepped down as scheduler leader")
+                    await lock.release()
+            except Exception as e:
+                logger.error(f"Scheduler leadership check failed: {e}", exc_info=True)
+                await lock.release()
+            # Standby: retry often so a dead leader is replaced within seconds
+            await asyncio.sleep(LEADER_RETRY_INTERVAL)
+    finally:
+        await lock.release()
+
+
+if __name__ == "__main__":
+    # Standalone scheduler, so API replicas can run with RUN_SCHEDULER_IN_API=false
+    asyncio.run(scheduler_loop())
@@ -0,0 +1,103 @@
+import os
+import socket
+import time
+
+from logger import logger
+from redis_client import redis_client
+
+
+LAG_BUCKETS = (0.1, 0.5, 1, 2, 5, 10, 30, 60, 300)  # seconds late vs. the planned fire time
+TICK_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)  # seconds per scheduler tick
+COUNTERS = ("ticks", "evaluated", "enqueued", "deferred", "replayed", "errors")
+INSTANCE_TTL = 60  # seconds an instance stays listed after its last tick
+
+
+def _bucket(value: float, buckets):
+    for bound in buckets:
+        if value <= bound:
+            return str(bound)
+    return "+Inf"
+
+
+class SchedulerMetrics:
+    """Scheduler counters and histograms kept in Redis.
+
+    Every scheduler instance, and the workers firing one-time runs, add to
+    the same hash so the API reports fleet-wide numbers without talking to
+    the scheduler processes. Counters only grow; compare two readings for
+    rates. If Redis is unreachable nothing is recorded.
+    """
+
+    def __init__(self, client, prefix: str = "orchkid:scheduler"):
+        self.client = client
+        self.prefix = prefix
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    def _key(self, suffix: str):
+        return f"{self.prefix}:{suffix}"
+
+    @staticmethod
+    def _observe(pipe, key, name, value, buckets):
+        pipe.hincrby(key, f"{name}_bucket:{_bucket(value, buckets)}", 1)
+        pipe.hincrbyfloat(key, f"{name}_sum", value)
+        pipe.hincrby(key, f"{name}_count", 1)
+
+    def record_tick(self, duration: float, lags=(), schedules: int = 0, **counts):
+        key = self._key("metrics")
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.hincrby(key, "ticks", 1)
+            for name, value in counts.items():
+                if value:
+                    pipe.hincrby(key, name, value)
+            self._observe(pipe, key, "tick_seconds", duration, TICK_BUCKETS)
+            for lag in lags:
+                self._observe(pipe, key, "fire_lag_seconds", lag, LAG_BUCKETS)
+            instance = self._key(f"instance:{self.instance_id}")
+            pipe.hset(instance, mapping={"schedules": schedules, "last_tick_at": time.time(), "last_tick_seconds": duration})
+            pipe.expire(instance, INSTANCE_TTL)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Could not record scheduler metrics: {e}")
+
+    def record_fire(self, lag: float):
+        key = self._key("metrics")
+        try:
+            pipe = self.client.pipeline(transaction=False)
+            pipe.hincrby(key, "enqueued", 1)
+            self._observe(pipe, key, "fire_lag_seconds", lag, LAG_BUCKETS)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"Could not record scheduler metrics: {e}")
+
+    @staticmethod
+    def _histogram(raw, name, buckets):
+        counts = {}
+        cumulative = 0
+        for bound in [str(b) for b in buckets] + ["+Inf"]:
+            cumulative += int(raw.get(f"{name}_bucket:{bound}", 0))
+            counts[bound] = cumulative
+        count = int(raw.get(f"{name}_count", 0))
+        total = float(raw.get(f"{name}_sum", 0))
+        return {"buckets": counts, "count": count, "sum": total, "avg": total / count if count else 0.0}
+
+    def snapshot(self):
+        raw = self.client.hgetall(self._key("metrics"))
+        instances = {}
+        for key in self.client.scan_iter(match=self._key("instance:*"), count=100):
+            info = self.client.hgetall(key)
+            if info:
+                instances[key.rsplit(":instance:", 1)[1]] = {
+                    "schedules": int(info.get("schedules", 0)),
+                    "last_tick_at": float(info.get("last_tick_at", 0)),
+                    "last_tick_seconds": float(info.get("last_tick_seconds", 0)),
+                }
+        return {
+            **{name: int(raw.get(name, 0)) for name in COUNTERS},
+            "fire_lag_seconds": self._histogram(raw, "fire_lag_seconds", LAG_BUCKETS),
+            "tick_seconds": self._histogram(raw, "tick_seconds", TICK_BUCKETS),
+            "instances": instances,
+        }
+
+
+scheduler_metrics = SchedulerMetrics(redis_client)
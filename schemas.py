@@ -1,5 +1,5 @@
 from pydantic import BaseModel, model_validator, field_validator, Field, conint
-from typing import Optional, Annotated
+from typing import Optional, Annotated, List, Literal
 import datetime
 import os
 
@@ -11,6 +11,40 @@ class SSHCommandRequest(BaseModel):
     command_description: Optional[str] = None  # Optional description of the command
 
 
+class FanoutRequest(BaseModel):
+    server_ids: Optional[List[int]] = None
+    tag: Optional[str] = None  # Match servers whose tags contain this tag
+    command: Optional[str] = None  # Either an ad-hoc command...
+    script_id: Optional[int] = None  # ...or an uploaded script
+    command_description: Optional[str] = None
+    concurrency: Optional[conint(ge=1)] = None
+
+    @model_validator(mode='after')
+    def check_target_and_action(cls, values):
+        if not values.server_ids and not values.tag:
+            raise ValueError("Either server_ids or tag must be provided")
+        if bool(values.command) == bool(values.script_id):
+            raise ValueError("Provide exactly one of command or script_id")
+        return values
+
+
+class FanoutJobResult(BaseModel):
+    job_id: int
+    server_id: int
+    hostname: str
+    command_status: str
+    stdout: Optional[str] = None
+    stderr: Optional[str] = None
+
+
+class FanoutResponse(BaseModel):
+    total: int
+    completed: int = 0
+    failed: int = 0
+    queued: int = 0
+    jobs: List[FanoutJobResult]
+
+
 class CreateUser(BaseModel):
     runner: str
     password: str
@@ -47,10 +81,20 @@ class JobResponse(BaseModel):
     command_status: str
     runner: str
     run_at: datetime.datetime
+    lane: Optional[str] = None
+    queue_wait: Optional[float] = None  # seconds the job waited for a worker
     class Config:
         from_attributes = True
 
 
+class LaneWaitResponse(BaseModel):
+    lane: str
+    jobs: int
+    avg_wait: float  # seconds
+    p95_wait: float
+    max_wait: float
+
+
 class ScriptUploadRequest(BaseModel):
     name: str
     description: Optional[str] = None
@@ -100,6 +144,10 @@ class ScriptDetails(BaseModel):
     hostname: str  # Hostname where the script is uploaded
     username: str  # Username for the remote host
     upload_status : str
+    checksum: Optional[str] = None  # SHA-256 of the uploaded content
+    bytes_sent: Optional[int] = None  # by the last upload
+    bytes_saved: Optional[int] = None  # by the last upload, when the remote copy was unchanged
+    transfers_skipped: int = 0  # uploads skipped as unchanged
     created_at: datetime.datetime
     updated_at: datetime.datetime
     runner: str  # Runner who uploaded the script
@@ -125,12 +173,40 @@ class ScriptUpdateRequest(BaseModel):
             raise ValueError("Only .sh or .py files are allowed")
         return v
 
+class PublishScriptRequest(BaseModel):
+    server_ids: Optional[List[int]] = None
+    tag: Optional[str] = None  # Publish to every server carrying this tag
+
+    @model_validator(mode='after')
+    def check_targets(cls, values):
+        if not values.server_ids and not values.tag:
+            raise ValueError("Either server_ids or tag must be provided")
+        return values
+
+
+class ScriptTargetResponse(BaseModel):
+    id: int
+    script_id: int
+    server_id: int
+    upload_status: str
+    checksum: Optional[str] = None
+    bytes_sent: Optional[int] = None
+    error: Optional[str] = None
+    updated_at: Optional[datetime.datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
 class ScheduleJobRequest(BaseModel):
     script_id: int  # ID of the job to be scheduled
     cron_expression: Optional[str] = None  # Cron expression for scheduling
     one_time_run: Optional[datetime.datetime] = None  # Flag for one-time run
     timezone: Optional[str] = None # Timezone for the scheduled job
     is_active: bool = True  # To manage active/inactive status
+    spread_seconds: Optional[int] = Field(default=None, ge=0)  # jitter window; runs are smeared across it
+    misfire_policy: Optional[Literal["skip", "run_once", "run_all"]] = None  # what to do with runs missed while down
+    misfire_limit: Optional[int] = Field(default=None, ge=1)  # most missed runs replayed under run_all
     
     @model_validator(mode='after')
     def check_schedule_requirements(cls,values):
@@ -149,6 +225,9 @@ class ScheduleJobResponse(BaseModel):
     timezone: Optional[str] = None  # Timezone for the scheduled job
     is_active: bool = True  # To manage active/inactive status
     last_run_at: Optional[datetime.datetime] = None  # Last run time of the scheduled job
+    spread_seconds: Optional[int] = None
+    misfire_policy: Optional[str] = None
+    misfire_limit: Optional[int] = None
 
     class Config:
         from_attributes = True
@@ -158,6 +237,9 @@ class ScheduleJobEdit(BaseModel):
     cron_expression: Optional[str] = None 
     one_time_run: Optional[datetime.datetime] = None
     is_active: bool = True 
+    spread_seconds: Optional[int] = Field(default=None, ge=0)
+    misfire_policy: Optional[Literal["skip", "run_once", "run_all"]] = None
+    misfire_limit: Optional[int] = Field(default=None, ge=1)
 
     @model_validator(mode='after')
     def check_schedule_requirements(cls,values):
@@ -186,10 +268,62 @@ class ServerAddResponse(BaseModel):
     added_by: int
     port: Optional[conint(ge=1, le=65535)] = 22
     tags: Optional[str] 
+    circuit_state: Optional[str] = None  # closed, open, half_open or unknown
 
     class Config:
         from_attributes = True
 
+
+class HistogramResponse(BaseModel):
+    buckets: dict[str, int]  # cumulative count per upper bound, in seconds
+    count: int
+    sum: float
+    avg: float
+
+
+class SchedulerInstanceResponse(BaseModel):
+    schedules: int  # schedules held in memory
+    last_tick_at: float
+    last_tick_seconds: float
+
+
+class SchedulerMetricsResponse(BaseModel):
+    ticks: int
+    evaluated: int  # schedules found due
+    enqueued: int  # runs handed to Celery
+    deferred: int  # due schedules pushed back by fire-rate limits
+    replayed: int  # missed runs replayed under run_all
+    errors: int
+    fire_lag_seconds: HistogramResponse
+    tick_seconds: HistogramResponse
+    instances: dict[str, SchedulerInstanceResponse]
+
+
+class CalendarBucket(BaseModel):
+    start: datetime.datetime
+    runs: int
+    schedules: int
+
+
+class CalendarResponse(BaseModel):
+    start: datetime.datetime
+    end: datetime.datetime
+    bucket_minutes: int
+    total_runs: int
+    buckets: List[CalendarBucket]
+
+
+class HostStateResponse(BaseModel):
+    server_id: int
+    hostname: str
+    port: int
+    state: str
+    failures: int = 0
+    retry_in: int = 0  # Seconds until a half-open probe is allowed
+    last_error: Optional[str] = None
+    last_failure_at: Optional[float] = None
+    last_success_at: Optional[float] = None
+
 class SerevrEdit(BaseModel):
     owner_id: Optional[int] = None
     key_path: Optional[str] = None
@@ -1,27 +1,90 @@
 from http.client import HTTPException
-from paramiko import SSHClient, AutoAddPolicy, RSAKey
 #from pathlib import Path
 from logger import logger  # ✅ use shared logger
 import os
+import hashlib
+import shlex
+import threading
+import time
+from ssh_pool import ssh_pool
 
 
+# Refill by elapsed Redis time, take nbytes, return the seconds to wait (as a
+# string: Lua numbers are truncated to integers on the way out)
+CONSUME_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or rate
+local updated = tonumber(state[2]) or now
+tokens = math.min(rate, tokens + (now - updated) * rate) - tonumber(ARGV[2])
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], 60)
+if tokens < 0 then
+    return tostring(-tokens / rate)
+end
+return '0'
+"""
 
-def run_scp_command(hostname: str, username: str, source: str, destination: str, key_path: str, timeout: int = 30):
+
+class ByteRateLimiter:
+    """Token bucket in bytes per second kept in Redis.
+
+    Every thread, task and worker using the same key shares one budget.
+    Bytes are reported in steps of about 50 ms worth of the rate so a
+    transfer doesn't make a Redis call per SFTP chunk. If Redis is
+    unreachable transfers are not throttled.
+    """
+
+    def __init__(self, client, key: str, rate: int):
+        self.key = key
+        self.rate = rate
+        self.step = max(rate // 20, 1)
+        self._consume = client.register_script(CONSUME_SCRIPT)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def consume(self, nbytes: int):
+        with self._lock:
+            self._pending += nbytes
+            if self._pending < self.step:
+                return
+            nbytes, self._pending = self._pending, 0
+        try:
+            wait = float(self._consume(keys=[self.key], args=[self.rate, nbytes]))
+        except Exception as e:
+            logger.warning(f"Bandwidth limiter {self.key} unavailable, not throttling: {e}")
+            return
+        if wait:
+            time.sleep(wait)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def remote_sha256(client, path: str):
+    _, stdout, _ = client.exec_command(f"sha256sum {shlex.quote(path)} 2>/dev/null")
+    output = stdout.read().decode().strip()
+    stdout.channel.recv_exit_status()
+    return output.split()[0] if output else None
+
+
+def run_scp_command(hostname: str, username: str, source: str, destination: str, key_path: str, timeout: int = 30, port: int = 22, checksum: str = None, limiters=()):
     logger.info(f"Connecting to {hostname} as {username}")
-    KEY_PATH = key_path
-    private_key = RSAKey.from_private_key_file(str(KEY_PATH))
-    logger.info(f"Using private key from {KEY_PATH}")
-    if not private_key:
-        logger.error(f"Private key not found at {KEY_PATH}")
-        raise FileNotFoundError(f"Private key not found at {KEY_PATH}")
+    result = {"transferred": False, "bytes_sent": 0, "bytes_saved": 0, "checksum": checksum}
 
     try:
-        with SSHClient() as client:
-            client.set_missing_host_key_policy(AutoAddPolicy())
-            client.connect(hostname, username=username, pkey=private_key, timeout=timeout)
+        with ssh_pool.connection(hostname, username, key_path, port=port, timeout=timeout) as conn:
             logger.info(f"Connected to {hostname} successfully")
             
-            sftp = client.open_sftp()
+            sftp = conn.open_sftp()
+            client = conn.client
             try:
                 sftp.stat(f"/home/{username}/bin/")
             except FileNotFoundError:
@@ -30,11 +93,34 @@ def run_scp_command(hostname: str, username: str, source: str, destination: str,
             if not os.path.exists(source):
                 logger.error(f"Local script not found: {source}")
                 raise HTTPException(status_code=400, detail="Local script not found")
+
+            # Skip the transfer entirely when the remote copy already has the same content
+            size = os.path.getsize(source)
+            result["checksum"] = result["checksum"] or file_sha256(source)
+            if remote_sha256(client, destination) == result["checksum"]:
+                sftp.close()
+                result["bytes_saved"] = size
+                logger.info(f"{destination} on {hostname} is unchanged, skipped transfer of {size} bytes")
+                return result
+
             logger.info(f"Trasnsferring file from {source} to {destination}")
-            sftp.put(source, destination)
-            client.exec_command(f"chmod +x {destination}")
+            callback = None
+            if limiters:
+                sent = [0]
+
+                def callback(transferred, total):
+                    for limiter in limiters:
+                        limiter.consume(transferred - sent[0])
+                    sent[0] = transferred
+
+            sftp.put(source, destination, callback=callback)
+            _, chmod_out, _ = client.exec_command(f"chmod +x {shlex.quote(destination)}")
+            chmod_out.channel.recv_exit_status()
             sftp.close()
+            result["transferred"] = True
+            result["bytes_sent"] = size
             logger.info(f"File transferred successfully from {source} to {destination}")
+            return result
             
     except Exception as e:
         logger.error(f"SCP transfer failed: {e}", exc_info=True)
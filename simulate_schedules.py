@@ -0,0 +1,241 @@
+"""Offline load simulator for schedules.
+
+Replays every active ScheduleJob over a time range with the scheduler's own
+cron evaluation (spread included) and fire-rate caps, and reports the
+expected jobs per minute, the worst bursts and the per-host concurrency peaks.
+
+    python simulate_schedules.py --hours 24
+    python simulate_schedules.py --start 2026-11-02T00:00 --hours 168 --duration 120
+    python simulate_schedules.py --add "*/5 * * * *;3;40"   # what if 40 more schedules hit server 3
+"""
+import argparse
+import json
+from bisect import bisect_right
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+import pytz
+
+from config import settings
+from cron_utils import schedule_timezone, iter_cron_fires
+from db_stuffs.database import SessionLocal
+from db_stuffs.models import ScheduleJob, Scripts, Server
+from scheduler import ScheduleEntry
+
+
+def load_entries(db):
+    rows = (
+        db.query(ScheduleJob, Scripts, Server)
+        .join(Scripts, ScheduleJob.script_id == Scripts.id)
+        .join(Server, Scripts.server_id == Server.id)
+        .filter(ScheduleJob.is_active.is_(True))
+        .all()
+    )
+    return [ScheduleEntry.from_row(sched, script, server) for sched, script, server in rows]
+
+
+def hypothetical_entries(specs, first_id: int):
+    """Entries for --add "CRON;SERVER_ID[;COUNT[;SPREAD]]" options."""
+    entries = []
+    for spec in specs:
+        parts = spec.split(";")
+        if len(parts) < 2:
+            raise SystemExit(f"--add expects 'CRON;SERVER_ID[;COUNT[;SPREAD]]', got {spec!r}")
+        cron, server_id = parts[0].strip(), int(parts[1])
+        count = int(parts[2]) if len(parts) > 2 and parts[2] else 1
+        spread = int(parts[3]) if len(parts) > 3 and parts[3] else 0
+        for _ in range(count):
+            entries.append(ScheduleEntry(
+                id=first_id, script_id=0, cron_expression=cron, one_time_run=None, timezone=None,
+                last_run_at=None, file_name="", description=None, runner="", server_id=server_id,
+                hostname=f"server {server_id}", username="", key_path="", spread=spread,
+            ))
+            first_id += 1
+    return entries
+
+
+def apply_rate_caps(per_host, max_per_second: int, host_per_second: int):
+    """Delay fires the way Scheduler._admit does.
+
+    At most max_per_second fires go out per second overall and
+    host_per_second per server; the rest wait for the next second. Within a
+    second servers are served in id order, an approximation of the heap's
+    order. Returns the fires per server per second after the caps.
+    """
+    if not max_per_second and not host_per_second:
+        return per_host
+    arrivals = defaultdict(dict)  # second -> server id -> fires
+    for server_id, fires in per_host.items():
+        for ts, count in fires.items():
+            arrivals[ts][server_id] = count
+    seconds = sorted(arrivals)
+
+    capped = defaultdict(Counter)
+    backlog = Counter()
+    i, ts = 0, None
+    while i < len(seconds) or backlog:
+        if not backlog:
+            ts = seconds[i]
+        if i < len(seconds) and seconds[i] == ts:
+            backlog.update(arrivals[ts])
+            i += 1
+        budget = max_per_second or float("inf")
+        for server_id in sorted(backlog):
+            take = min(backlog[server_id], host_per_second or backlog[server_id], budget)
+            if take <= 0:
+                break
+            capped[server_id][ts] += take
+            budget -= take
+            backlog[server_id] -= take
+            if not backlog[server_id]:
+                del backlog[server_id]
+        ts += 1
+    return capped
+
+
+def simulate(entries, start: datetime, end: datetime, duration: int = 60, max_per_second: int = 0, host_per_second: int = 0):
+    """Expected fires per second overall and per host in (start, end].
+
+    Fires held back by the rate caps may spill past end.
+
+
+    Cron expressions are evaluated once per (expression, timezone) and the
+    result is shared by every schedule using it, shifted by each schedule's
+    spread offset. That is what keeps 50k schedules down to a few thousand
+    croniter walks.
+    """
+    groups = defaultdict(Counter)  # (cron, tz) -> (offset seconds, server id) -> schedules
+    hostnames = {}
+    one_time = []
+    for entry in entries:
+        # --add entries carry a placeholder name; keep the real one if the server exists
+        hostnames.setdefault(entry.server_id, entry.hostname)
+        if entry.one_time_run and not entry.last_run_at:
+            one_time.append(entry)
+        if entry.cron_expression:
+            groups[entry.cron_expression, entry.timezone][int(entry.offset().total_seconds()), entry.server_id] += 1
+
+    lo, hi = int(start.timestamp()), int(end.timestamp())
+    per_second = Counter()
+    per_host = defaultdict(Counter)  # server id -> second -> fires
+
+    for (cron, tz), weights in groups.items():
+        max_offset = max(offset for offset, _ in weights)
+        base = [int(fire_at.timestamp()) for fire_at in iter_cron_fires(cron, schedule_timezone(tz), start - timedelta(seconds=max_offset), end)]
+        for (offset, server_id), count in weights.items():
+            # Fires that land inside (lo, hi] once shifted by this offset
+            window = base[bisect_right(base, lo - offset):bisect_right(base, hi - offset)]
+            per_host[server_id].update({ts + offset: count for ts in window})
+
+    for entry in one_time:
+        # One-time runs fire through a Celery ETA at one_time_run exactly, without spread
+        ts = int(entry.one_time_run.timestamp())
+        if lo < ts <= hi:
+            per_host[entry.server_id][ts] += 1
+
+    per_host = apply_rate_caps(per_host, max_per_second, host_per_second)
+    for fires in per_host.values():
+        per_second.update(fires)
+
+    peaks = {server_id: peak_concurrency(fires, duration) for server_id, fires in per_host.items()}
+    return per_second, peaks, hostnames
+
+
+def peak_concurrency(fires: Counter, duration: int):
+    """Highest number of jobs running at once on a host if each takes `duration` seconds."""
+    duration = max(duration, 1)
+    times = sorted(fires)
+    running = best = 0
+    best_at = times[0] if times else None
+    tail = 0
+    for ts in times:
+        running += fires[ts]
+        while times[tail] <= ts - duration:
+            running -= fires[times[tail]]
+            tail += 1
+        if running > best:
+            best, best_at = running, ts
+    return best, best_at
+
+
+def report(per_second: Counter, peaks, hostnames, start: datetime, end: datetime, top: int, rate_caps: dict):
+    per_minute = Counter()
+    for ts, count in per_second.items():
+        per_minute[ts // 60 * 60] += count
+    minutes = max(1, int((end - start).total_seconds() // 60))
+    total = sum(per_second.values())
+
+    def iso(ts):
+        return datetime.fromtimestamp(ts, pytz.UTC).isoformat()
+
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "total_runs": total,
+        "rate_caps": rate_caps,
+        "runs_per_minute": {
+            "mean": round(total / minutes, 2),
+            "peak": max(per_minute.values(), default=0),
+            "busy_minutes": len(per_minute),
+        },
+        "worst_seconds": [{"at": iso(ts), "runs": count} for ts, count in per_second.most_common(top)],
+        "worst_minutes": [{"at": iso(ts), "runs": count} for ts, count in per_minute.most_common(top)],
+        "host_peaks": [
+            {"server_id": server_id, "hostname": hostnames.get(server_id), "concurrent": peak, "at": iso(at)}
+            for server_id, (peak, at) in sorted(peaks.items(), key=lambda item: -item[1][0])[:top]
+        ],
+    }
+
+
+def print_report(result, duration: int):
+    print(f"{result['total_runs']} runs between {result['start']} and {result['end']}")
+    caps = result["rate_caps"]
+    print(f"Fire-rate caps: {caps['max_per_second'] or 'none'} per second overall, {caps['host_per_second'] or 'none'} per host")
+    rpm = result["runs_per_minute"]
+    print(f"Per minute: mean {rpm['mean']}, peak {rpm['peak']}, {rpm['busy_minutes']} minutes with runs")
+    print("\nWorst seconds:")
+    for row in result["worst_seconds"]:
+        print(f"  {row['at']}  {row['runs']}")
+    print("\nWorst minutes:")
+    for row in result["worst_minutes"]:
+        print(f"  {row['at']}  {row['runs']}")
+    print(f"\nPeak concurrency per host (jobs assumed to take {duration}s):")
+    for row in result["host_peaks"]:
+        print(f"  {row['hostname']} (server {row['server_id']})  {row['concurrent']} at {row['at']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the load created by the active schedules")
+    parser.add_argument("--start", help="ISO time to start from, UTC unless an offset is given (default: now)")
+    parser.add_argument("--hours", type=float, default=24, help="length of the simulated range")
+    parser.add_argument("--duration", type=int, default=60, help="assumed seconds per job, for host concurrency")
+    parser.add_argument("--top", type=int, default=10, help="rows per section")
+    parser.add_argument("--add", action="append", default=[], metavar="CRON;SERVER_ID[;COUNT[;SPREAD]]",
+                        help="include hypothetical schedules; repeatable")
+    parser.add_argument("--max-fires-per-second", type=int, default=settings.SCHEDULER_MAX_FIRES_PER_SECOND,
+                        help="overall fire-rate cap to model, 0 for none (default: SCHEDULER_MAX_FIRES_PER_SECOND)")
+    parser.add_argument("--host-fires-per-second", type=int, default=settings.SCHEDULER_HOST_FIRES_PER_SECOND,
+                        help="per-server fire-rate cap to model, 0 for none (default: SCHEDULER_HOST_FIRES_PER_SECOND)")
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    start = datetime.fromisoformat(args.start) if args.start else datetime.now(pytz.UTC)
+    if start.tzinfo is None:
+        start = pytz.UTC.localize(start)
+    end = start + timedelta(hours=args.hours)
+
+    with SessionLocal() as db:
+        entries = load_entries(db)
+    entries += hypothetical_entries(args.add, first_id=max((e.id for e in entries), default=0) + 1)
+
+    rate_caps = {"max_per_second": args.max_fires_per_second, "host_per_second": args.host_fires_per_second}
+    per_second, peaks, hostnames = simulate(entries, start, end, args.duration, **rate_caps)
+    result = report(per_second, peaks, hostnames, start, end, args.top, rate_caps)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_report(result, args.duration)
+
+
+if __name__ == "__main__":
+    main()
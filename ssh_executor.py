@@ -0,0 +1,34 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from config import settings
+from ssh_utils import run_ssh_command
+
+
+# paramiko is blocking, so ad-hoc commands from the API run on this bounded
+# pool instead of on the event loop. The per-host semaphores match the SSH
+# pool's per-host limit so threads never sit blocked waiting for a slot.
+_executor = ThreadPoolExecutor(max_workers=settings.SSH_EXECUTOR_THREADS, thread_name_prefix="ssh-exec")
+_host_limits = {}
+
+
+def _host_limit(hostname: str, port: int):
+    key = (hostname, port or 22)
+    if key not in _host_limits:
+        _host_limits[key] = asyncio.Semaphore(settings.SSH_POOL_MAX_PER_HOST)
+    return _host_limits[key]
+
+
+async def run_ssh_command_async(hostname: str, username: str, command: str, key_path: str, timeout: int = 30, port: int = 22, on_output=None):
+    # on_output is called from the executor thread, not the event loop
+    async with _host_limit(hostname, port):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            _executor,
+            partial(run_ssh_command, hostname, username, command, key_path, timeout=timeout, port=port, on_output=on_output),
+        )
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,244 @@
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from paramiko import SSHClient, AutoAddPolicy
+
+from config import settings
+from key_store import key_store
+from circuit_breaker import circuit_breaker, counts_as_unreachable
+from logger import logger
+
+
+class PooledConnection:
+    """A connection checked out of the pool.
+
+    A connection that sat idle can be half-open: the health check only queues
+    bytes, so it passes. The first channel opened on a reused connection is
+    therefore the real check, and if it fails the connection is replaced once
+    with a fresh one instead of failing the caller.
+    """
+
+    def __init__(self, pool, key, client, reused: bool, timeout: int):
+        self.pool = pool
+        self.key = key
+        self.client = client
+        self.reused = reused
+        self.timeout = timeout
+        self._lock = threading.Lock()
+
+    def _retry_fresh(self, client, error):
+        # Several threads may share one connection (batches); only the first reconnects
+        with self._lock:
+            if client is self.client:
+                if not self.reused:
+                    raise error
+                logger.info(f"Pooled SSH connection to {self.key[0]}:{self.key[1]} was dead ({error}), reconnecting")
+                self.pool._close(client)
+                self.client = None
+                self.client = self.pool._connect(self.key, self.timeout)
+                self.reused = False
+            return self.client
+
+    def exec_command(self, command: str):
+        """Open a session channel and start command on it."""
+        client = self.client
+        try:
+            channel = self._start(client, command)
+        except Exception as e:
+            client = self._retry_fresh(client, e)
+            channel = self._start(client, command)
+        self.reused = False  # proven alive; later failures are real
+        return channel
+
+    def _start(self, client, command):
+        channel = client.get_transport().open_session(timeout=self.timeout)
+        try:
+            channel.exec_command(command)
+        except Exception:
+            channel.close()
+            raise
+        return channel
+
+    def open_sftp(self):
+        client = self.client
+        try:
+            sftp = client.open_sftp()
+        except Exception as e:
+            client = self._retry_fresh(client, e)
+            sftp = client.open_sftp()
+        self.reused = False
+        return sftp
+
+
+class SSHConnectionPool:
+    """Process-wide pool of live SSH connections.
+
+    Connections are keyed by (hostname, port, username, key_path) so every job
+    against the same server reuses an already authenticated transport instead
+    of paying for a TCP + key exchange + auth handshake per command.
+    """
+
+    def __init__(self, max_per_host: int, idle_timeout: int, keepalive: int):
+        self.max_per_host = max_per_host
+        self.idle_timeout = idle_timeout
+        self.keepalive = keepalive
+        self._lock = threading.Lock()
+        self._idle = defaultdict(list)  # key -> [(client, last_used), ...]
+        self._slots = {}  # key -> BoundedSemaphore(max_per_host)
+        self._reaper_pid = None
+
+    def _ensure_reaper(self):
+        # Started lazily so each forked worker process gets its own reaper thread
+        if self._reaper_pid == os.getpid():
+            return
+        self._reaper_pid = os.getpid()
+        interval = max(1, min(self.idle_timeout, 60))
+        threading.Thread(target=self._reap_forever, args=(interval,), name="ssh-pool-reaper", daemon=True).start()
+
+    def _reap_forever(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.prune()
+            except Exception as e:
+                logger.error(f"SSH pool prune failed: {e}", exc_info=True)
+
+    def _slot(self, key):
+        with self._lock:
+            if key not in self._slots:
+                self._slots[key] = threading.BoundedSemaphore(self.max_per_host)
+            return self._slots[key]
+
+    def _connect(self, key, timeout):
+        hostname, port, username, key_path = key
+        private_key = key_store.get(key_path)
+
+        circuit_breaker.before_call(hostname, port, probe_timeout=timeout)
+        client = SSHClient()
+        client.set_missing_host_key_policy(AutoAddPolicy())
+        try:
+            client.connect(hostname, port=port, username=username, pkey=private_key, timeout=timeout)
+        except Exception as e:
+            self._close(client)
+            if counts_as_unreachable(e):
+                circuit_breaker.record_failure(hostname, port, e)
+            raise
+        circuit_breaker.record_success(hostname, port)
+        if self.keepalive:
+            client.get_transport().set_keepalive(self.keepalive)
+        logger.info(f"Opened pooled SSH connection to {username}@{hostname}:{port}")
+        return client
+
+    @staticmethod
+    def _is_healthy(client):
+        transport = client.get_transport()
+        if transport is None or not transport.is_active() or not transport.is_authenticated():
+            return False
+        try:
+            transport.send_ignore()
+        except Exception:
+            return False
+        return True
+
+    @staticmethod
+    def _close(client):
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    def _checkout(self, key):
+        """An idle connection that passes the health check, or None."""
+        now = time.monotonic()
+        while True:
+            with self._lock:
+                idle = self._idle[key]
+                if not idle:
+                    break
+                client, last_used = idle.pop()
+
+            if now - last_used > self.idle_timeout or not self._is_healthy(client):
+                logger.info(f"Dropping stale SSH connection to {key[0]}:{key[1]}")
+                self._close(client)
+                continue
+            return client
+
+        return None
+
+    def _checkin(self, key, client):
+        with self._lock:
+            self._idle[key].append((client, time.monotonic()))
+
+    @contextmanager
+    def connection(self, hostname: str, username: str, key_path: str, port: int = 22, timeout: int = 30):
+        key = (hostname, port or 22, username, key_path)
+        self._ensure_reaper()
+        slot = self._slot(key)
+        if not slot.acquire(timeout=timeout):
+            raise TimeoutError(f"No free SSH connection slot for {hostname} after {timeout}s")
+
+        conn = None
+        try:
+            client = self._checkout(key)
+            conn = PooledConnection(self, key, client or self._connect(key, timeout), client is not None, timeout)
+            yield conn
+        except Exception:
+            # Never hand a connection that failed mid-use back to the pool
+            if conn is not None and conn.client is not None:
+                self._close(conn.client)
+                conn.client = None
+            raise
+        finally:
+            if conn is not None and conn.client is not None:
+                self._checkin(key, conn.client)
+            slot.release()
+
+    def prune(self):
+        """Close connections that have been idle longer than idle_timeout."""
+        now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key, idle in self._idle.items():
+                keep = []
+                for client, last_used in idle:
+                    if now - last_used > self.idle_timeout:
+                        expired.append(client)
+                    else:
+                        keep.append((client, last_used))
+                self._idle[key] = keep
+        for client in expired:
+            self._close(client)
+        return len(expired)
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, defaultdict(list)
+        for clients in idle.values():
+            for client, _ in clients:
+                self._close(client)
+
+    def reset(self):
+        # Called in forked children (Celery prefork): the inherited sockets
+        # belong to the parent, so forget them without sending anything.
+        self._lock = threading.Lock()
+        self._idle = defaultdict(list)
+        self._slots = {}
+        self._reaper_pid = None
+
+    def stats(self):
+        with self._lock:
+            return {f"{k[2]}@{k[0]}:{k[1]}": len(v) for k, v in self._idle.items() if v}
+
+
+ssh_pool = SSHConnectionPool(
+    max_per_host=settings.SSH_POOL_MAX_PER_HOST,
+    idle_timeout=settings.SSH_POOL_IDLE_TIMEOUT,
+    keepalive=settings.SSH_KEEPALIVE_INTERVAL,
+)
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=ssh_pool.reset)
+
@@ -1,34 +1,116 @@
-from paramiko import SSHClient, AutoAddPolicy, RSAKey
+import codecs
+import select
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from config import settings
 from logger import logger  # ✅ use shared logger
+from ssh_pool import ssh_pool
 
 #KEY_PATH = Path.home() / ".ssh" / "redhood_key"
 
-def run_ssh_command(hostname: str, username: str, command: str,key_path: str, timeout: int = 30):
+READ_CHUNK = 32768
+
+
+class OutputBuffer:
+    """Keeps the last max_chars characters of a stream, decoding UTF-8 incrementally."""
+
+    def __init__(self, max_chars: int):
+        self.max_chars = max_chars
+        self.size = 0
+        self.truncated = False
+        self._chunks = deque()
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    def write(self, data: bytes) -> str:
+        text = self._decoder.decode(data)
+        if text:
+            self._chunks.append(text)
+            self.size += len(text)
+            while self.size > self.max_chars and len(self._chunks) > 1:
+                self.size -= len(self._chunks.popleft())
+                self.truncated = True
+        return text
+
+    def getvalue(self) -> str:
+        text = "".join(self._chunks) + self._decoder.decode(b"", final=True)
+        if self.truncated:
+            text = "[... output truncated ...]\n" + text
+        return text
+
+
+def read_channel(channel, timeout: int = 30, on_output=None, flush_interval: float = None):
+    """Drain stdout and stderr of an exec channel as data arrives.
+
+    Both streams are read interleaved, so a chatty stderr can never fill its
+    window while we are blocked on stdout. on_output(out_chunk, err_chunk) is
+    called at most every flush_interval seconds with the text received since
+    the previous call.
+    """
+    if flush_interval is None:
+        flush_interval = settings.JOB_OUTPUT_FLUSH_INTERVAL
+    out_buf = OutputBuffer(settings.SSH_OUTPUT_MAX_CHARS)
+    err_buf = OutputBuffer(settings.SSH_OUTPUT_MAX_CHARS)
+    pending_out, pending_err = [], []
+    last_flush = last_data = time.monotonic()
+
+    def flush():
+        nonlocal last_flush
+        if on_output and (pending_out or pending_err):
+            on_output("".join(pending_out), "".join(pending_err))
+            pending_out.clear()
+            pending_err.clear()
+        last_flush = time.monotonic()
+
+    while True:
+        got_data = False
+        while channel.recv_ready():
+            text = out_buf.write(channel.recv(READ_CHUNK))
+            if on_output:
+                pending_out.append(text)
+            got_data = True
+        while channel.recv_stderr_ready():
+            text = err_buf.write(channel.recv_stderr(READ_CHUNK))
+            if on_output:
+                pending_err.append(text)
+            got_data = True
+
+        now = time.monotonic()
+        if got_data:
+            last_data = now
+        elif channel.exit_status_ready() and not channel.recv_ready() and not channel.recv_stderr_ready():
+            break
+        elif timeout and now - last_data > timeout:
+            raise TimeoutError(f"No output from command for {timeout}s")
+        else:
+            select.select([channel], [], [], min(flush_interval, 0.5))
+
+        if now - last_flush >= flush_interval:
+            flush()
+
+    flush()
+    return out_buf.getvalue().strip(), err_buf.getvalue().strip(), channel.recv_exit_status()
+
+
+def run_ssh_command(hostname: str, username: str, command: str,key_path: str, timeout: int = 30, port: int = 22, on_output=None):
     #KEY_PATH = "/home/batman/.ssh/redhood_key"
-    KEY_PATH = key_path
     logger.info(f"Connecting to {hostname} as {username}")
-    private_key = RSAKey.from_private_key_file(str(KEY_PATH))
-    logger.info(f"Using private key from {KEY_PATH}")
-    if not private_key:
-        logger.error(f"Private key not found at {KEY_PATH}")
-        raise FileNotFoundError(f"Private key not found at {KEY_PATH}")
-        
+
     try:
-        with SSHClient() as client:
-            client.set_missing_host_key_policy(AutoAddPolicy())
-            client.connect(hostname, username=username, pkey=private_key, timeout=timeout)
+        with ssh_pool.connection(hostname, username, key_path, port=port, timeout=timeout) as conn:
             logger.info(f"Connected to {hostname} successfully")
             
-            stdin, stdout, stderr = client.exec_command(command, timeout=timeout)
-            out = stdout.read().decode().strip()
-            err = stderr.read().decode().strip()
+            channel = conn.exec_command(command)
+            try:
+                out, err, exit_status = read_channel(channel, timeout=timeout, on_output=on_output)
+            finally:
+                channel.close()
             
             # if out:
             #     logger.info(f"Command output: {out}")
             # if err:
             #     logger.error(f"Command error: {err}")
-            exit_status = stdout.channel.recv_exit_status()
             if exit_status != 0:
                 logger.error(f"Command failed with exit status {exit_status}: !{err}!")
                 #print(out, err, exit_status)
@@ -38,7 +120,39 @@ def run_ssh_command(hostname: str, username: str, command: str,key_path: str, ti
         
     except Exception as e:
         logger.error(f"SSH connection failed: {e}", exc_info=True)
-        return {"out": "", "err": str(e)}
+        return "", str(e)
+
+def run_ssh_commands(hostname: str, username: str, commands: list, key_path: str, timeout: int = 30, port: int = 22, channels: int = 1):
+    """Run several commands over one SSH connection.
+
+    Up to `channels` commands run at once, each on its own channel of the
+    same transport. Returns (out, err, exit_status) per command, in order; a
+    command that could not be run gets ("", error, None).
+    """
+    logger.info(f"Running {len(commands)} commands on {hostname} as {username} over one connection")
+
+    try:
+        with ssh_pool.connection(hostname, username, key_path, port=port, timeout=timeout) as conn:
+
+            def run_one(command):
+                try:
+                    channel = conn.exec_command(command)
+                    try:
+                        return read_channel(channel, timeout=timeout)
+                    finally:
+                        channel.close()
+                except Exception as e:
+                    logger.error(f"Command {command} on {hostname} failed: {e}")
+                    return "", str(e), None
+
+            if channels <= 1 or len(commands) <= 1:
+                return [run_one(command) for command in commands]
+            with ThreadPoolExecutor(max_workers=min(channels, len(commands))) as pool:
+                return list(pool.map(run_one, commands))
+
+    except Exception as e:
+        logger.error(f"SSH connection failed: {e}", exc_info=True)
+        return [("", str(e), None)] * len(commands)
 
 # def file_transfer(ssh_client, local_path: str, remote_path: str):
 #     logger.info(f"Transferring file from {local_path} to {remote_path}")
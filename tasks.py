@@ -1,93 +1,379 @@
-from celery_worker import celery_app
-from ssh_utils import run_ssh_command
-from scp_utils import run_scp_command
-from db_stuffs.database import get_db
-from db_stuffs.models import Scripts, Job, JobOutput, Server
+from celery_worker import celery_app, INTERACTIVE_LANE, SCHEDULED_LANE, BULK_LANE
+from celery.exceptions import Retry
+from ssh_utils import run_ssh_command, run_ssh_commands
+from scp_utils import run_scp_command, file_sha256, ByteRateLimiter
+from redis_client import redis_client
+from db_stuffs.database import session_scope
+from db_stuffs.models import Scripts, Job, JobOutput, Server, ScriptTarget, ScheduleJob
 from logger import logger
+from cron_utils import schedule_timezone, as_utc
 import os
+import uuid
+import random
+from datetime import datetime, timedelta
+import pytz
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from config import settings
+from sqlalchemy import func
+from output_store import store_output, append_output
+from scheduler_metrics import scheduler_metrics
+from host_limiter import host_limiter, UNLIMITED
 
 
-@celery_app.task(name="tasks.run_script")
-def run_script(script_id: int, job_id: int):
+def _host_slot_or_defer(task, hostname: str, tags: str, job_ids=()):
+    """Take a host slot, or re-queue the task with a delay if the host is full."""
+    lease = host_limiter.acquire(hostname, host_limiter.limit_for(tags))
+    if lease is not None:
+        return lease
+
+    if task.request.retries >= settings.HOST_SLOT_MAX_DEFERRALS:
+        logger.error(f"Giving up on {task.name} for {hostname} after {task.request.retries} deferrals")
+        if job_ids:
+            with session_scope() as db:
+                db.query(Job).filter(Job.id.in_(job_ids)).update({Job.command_status: "failed"}, synchronize_session=False)
+                db.commit()
+        raise RuntimeError(f"{hostname} stayed at its concurrency limit")
+
+    delay = settings.HOST_SLOT_RETRY_DELAY
+    logger.info(f"{hostname} is at its concurrency limit, deferring {task.name} (attempt {task.request.retries + 1})")
+    raise task.retry(countdown=delay + random.uniform(0, delay), max_retries=None)
+
+
+@celery_app.task(name="tasks.run_script", bind=True)
+def run_script(self, script_id: int, job_id: int):
     logger.info(f"Running script task for script ID: {script_id} and job ID: {job_id}")
 
-    logger.info("Acquiring database session for running script task")
-    db_gen = get_db()
-    logger.info("Database session acquired")
-    db = next(db_gen)
-    try:
-        script_exitst = db.query(Scripts).join(Server, Scripts.server_id == Server.id).filter(Scripts.id == script_id).first()
-        if not script_exitst:
-            raise ValueError(f"Script with ID {script_id} not found")
+    with session_scope() as db:
+        server = db.query(Server).join(Job, Server.id == Job.server_id).filter(Job.id == job_id).first()
+    if not server:
+        raise ValueError(f"Job with ID {job_id} not found")
 
-        job = db.query(Server).join(Job, Server.id == Job.server_id).filter(Job.id == job_id).first()
-        job_info = db.query(Job).filter(Job.id == job_id).first()
-        if not job:
-            raise ValueError(f"Job with ID {job_id} not found")
+    lease = _host_slot_or_defer(self, server.hostname, server.tags, [job_id])
+    with host_limiter.hold(lease):
+        return _execute_script(script_id, job_id)
 
-        command = f"bash /home/{job.username}/bin/{script_exitst.file_name}"
-        out, err = run_ssh_command(job.hostname, job.username, command, job.key_path)
 
+def enqueue_run(script_id: int, job_id: int, lane: str = SCHEDULED_LANE):
+    """Queue run_script on a priority lane; the Job row should carry the same lane."""
+    return run_script.apply_async((script_id, job_id), queue=lane)
 
-        # Save job output
-        job_output = JobOutput(job_id=job.id, stdout=out, stderr=err)
-        db.add(job_output)
 
-        # Update job status
-        job_info.command_status = 'completed' if not err else 'failed'
-        db.commit()
+def enqueue_batch(server_id: int, job_ids: list, lane: str = SCHEDULED_LANE):
+    return run_script_batch.apply_async((server_id, job_ids), queue=lane)
 
-        return {
-            "job_id": job.id,
-            "output": out,
-            "error": err
-        }
-    
-    except Exception as e:
-        logger.error(f"Error running script: {e}", exc_info=True)
-        if job:
-            job_info.command_status = 'failed'
+
+@celery_app.task(name="tasks.run_script_batch", bind=True)
+def run_script_batch(self, server_id: int, job_ids: list):
+    """Run several queued script jobs for one server on a single connection.
+
+    One SSH connection and one DB session cover the whole batch, and all
+    outputs and statuses are written in one commit. On a limited host every
+    parallel channel holds its own host slot.
+    """
+    logger.info(f"Running batch of {len(job_ids)} jobs on server {server_id}")
+    with session_scope() as db:
+        try:
+            server = db.query(Server).filter(Server.id == server_id).first()
+            if not server:
+                raise ValueError(f"Server with ID {server_id} not found")
+
+            leases = [_host_slot_or_defer(self, server.hostname, server.tags, job_ids)]
+            if leases[0] != UNLIMITED:
+                # Widen the batch only as far as free slots allow
+                while len(leases) < min(settings.BATCH_SSH_CHANNELS, len(job_ids)):
+                    lease = host_limiter.acquire(server.hostname, host_limiter.limit_for(server.tags))
+                    if not lease:
+                        break
+                    leases.append(lease)
+            channels = len(leases) if leases[0] != UNLIMITED else settings.BATCH_SSH_CHANNELS
+
+            with host_limiter.hold(*leases):
+                rows = (
+                    db.query(Job.id, Scripts.file_name)
+                    .outerjoin(Scripts, Job.job_id == Scripts.id)
+                    .filter(Job.id.in_(job_ids))
+                    .order_by(Job.id)
+                    .all()
+                )
+                runnable = [(job_id, file_name) for job_id, file_name in rows if file_name]
+                missing = [job_id for job_id, file_name in rows if not file_name]
+
+                db.query(Job).filter(Job.id.in_([job_id for job_id, _ in runnable])).update({
+                    Job.command_status: "running",
+                    Job.started_at: func.now(),
+                    Job.queue_wait: func.extract("epoch", func.now() - Job.run_at),
+                }, synchronize_session=False)
+                db.commit()
+
+                commands = [f"bash /home/{server.username}/bin/{file_name}" for _, file_name in runnable]
+                results = run_ssh_commands(
+                    server.hostname, server.username, commands, server.key_path,
+                    port=server.port or 22, channels=channels,
+                ) if commands else []
+
+                statuses = {"failed": list(missing)}
+                for (job_id, _), (out, err, _) in zip(runnable, results):
+                    job_output = JobOutput(job_id=job_id)
+                    store_output(db, job_output, out, err)
+                    db.add(job_output)
+                    statuses.setdefault("completed" if not err else "failed", []).append(job_id)
+                for status, ids in statuses.items():
+                    if ids:
+                        db.query(Job).filter(Job.id.in_(ids)).update({Job.command_status: status}, synchronize_session=False)
+                db.commit()
+
+            logger.info(f"Batch on {server.hostname} done: " + ", ".join(f"{len(ids)} {status}" for status, ids in statuses.items() if ids))
+            return {"server_id": server_id, "jobs": {status: ids for status, ids in statuses.items() if ids}}
+
+        except Exception as e:
+            if not isinstance(e, Retry):
+                logger.error(f"Batch on server {server_id} failed: {e}", exc_info=True)
+                db.rollback()
+                db.query(Job).filter(Job.id.in_(job_ids), Job.command_status.in_(("queued", "running"))).update(
+                    {Job.command_status: "failed"}, synchronize_session=False)
+                db.commit()
+            raise
+
+
+def _execute_script(script_id: int, job_id: int):
+    with session_scope() as db:
+        job = job_info = None
+        try:
+            script_exitst = db.query(Scripts).join(Server, Scripts.server_id == Server.id).filter(Scripts.id == script_id).first()
+            if not script_exitst:
+                raise ValueError(f"Script with ID {script_id} not found")
+
+            job = db.query(Server).join(Job, Server.id == Job.server_id).filter(Job.id == job_id).first()
+            job_info = db.query(Job).filter(Job.id == job_id).first()
+            if not job:
+                raise ValueError(f"Job with ID {job_id} not found")
+
+            command = f"bash /home/{job.username}/bin/{script_exitst.file_name}"
+
+            # Create the output row up front so partial output can be tailed while the script runs
+            job_output = JobOutput(job_id=job_info.id, stdout="", stderr="")
+            db.add(job_output)
+            job_info.command_status = 'running'
+            job_info.started_at = func.now()
+            job_info.queue_wait = func.extract("epoch", func.now() - Job.run_at)
             db.commit()
-        raise e
 
-    finally:
+            def flush_output(out_chunk, err_chunk):
+                append_output(db, job_output.id, out_chunk, err_chunk)
+                db.commit()
+
+            out, err = run_ssh_command(job.hostname, job.username, command, job.key_path, port=job.port, on_output=flush_output)
+            if not out:
+                # A connection lost mid-run returns only the error; keep what was streamed
+                db.refresh(job_output, ["stdout"])
+                out = job_output.stdout or ""
+
+            # Save job output
+            store_output(db, job_output, out, err)
 
-        if out == "out" and err == "err":
-            logger.error(f"No output or error returned for job ID {job.id}. This might indicate an issue with the command execution.")
-            job_info.command_status = 'failed'
+            # Update job status
+            job_info.command_status = 'completed' if not err else 'failed'
             db.commit()
-        
-        #logger.info("Committing database changes after running script task")
-        db_gen.close()
-        logger.info("Database session closed after running script task")
 
+            # Output lives in Postgres; keep the Celery result to a reference
+            return {
+                "job_id": job_id,
+                "status": job_info.command_status
+            }
 
-@celery_app.task(name="tasks.upload_script")
-def upload_script(source: str, destination: str,key_path : str ,hostname: str, username: str):
+        except Exception as e:
+            logger.error(f"Error running script: {e}", exc_info=True)
+            if job:
+                job_info.command_status = 'failed'
+                db.commit()
+            raise e
+
+
+@celery_app.task(name="tasks.upload_script", bind=True, ignore_result=True)
+def upload_script(self, source: str, destination: str,key_path : str ,hostname: str, username: str, port: int = 22):
     logger.info(f"Uploading script from {source} to {destination} on {hostname} as {username}")
-    db_gen = get_db()
-    db = next(db_gen)
-    script = db.query(Scripts).filter(Scripts.file_path == source).first()
-    if not script:
-        raise ValueError(f"Script with file path {source} not found")
-    logger.info("Database session acquired for script upload")
-    if not os.path.exists(source):
-        logger.error(f"Source script not found: {source}")
-        raise FileNotFoundError(f"Source script not found: {source}")
-    
-    try:
-        run_scp_command(hostname, username, source, destination, key_path)
-        logger.info(f"Script uploaded successfully from {source} to {destination}")
-        script.upload_status = "Completed"
+    with session_scope() as db:
+        script = db.query(Scripts).filter(Scripts.file_path == source, Scripts.hostname == hostname).first()
+        if not script:
+            raise ValueError(f"Script with file path {source} not found")
+        logger.info("Database session acquired for script upload")
+        if not os.path.exists(source):
+            logger.error(f"Source script not found: {source}")
+            raise FileNotFoundError(f"Source script not found: {source}")
+
+        tags = db.query(Server.tags).filter(Server.hostname == hostname, Server.username == username).scalar()
+        try:
+            lease = _host_slot_or_defer(self, hostname, tags)
+        except Retry:
+            raise
+        except Exception:
+            script.upload_status = "Failed"
+            db.commit()
+            raise
+        with host_limiter.hold(lease):
+            try:
+                transfer = run_scp_command(hostname, username, source, destination, key_path, port=port, checksum=file_sha256(source))
+                if transfer["transferred"]:
+                    logger.info(f"Script uploaded successfully from {source} to {destination} ({transfer['bytes_sent']} bytes)")
+                else:
+                    logger.info(f"Script {destination} unchanged on {hostname}, saved {transfer['bytes_saved']} bytes")
+                script.checksum = transfer["checksum"]
+                script.bytes_sent = transfer["bytes_sent"]
+                script.bytes_saved = transfer["bytes_saved"]
+                if not transfer["transferred"]:
+                    script.transfers_skipped = Scripts.transfers_skipped + 1
+                script.upload_status = "Completed"
+                db.commit()
+            except Exception as e:
+                logger.error(f"Failed to upload script: {e}", exc_info=True)
+                script.upload_status = "Failed"
+                db.commit()
+                raise e
+
+@celery_app.task(name="tasks.publish_script")
+def publish_script(script_id: int, target_ids: list):
+    logger.info(f"Publishing script ID {script_id} to {len(target_ids)} targets")
+    with session_scope() as db:
+        script = db.query(Scripts).filter(Scripts.id == script_id).first()
+        if not script:
+            raise ValueError(f"Script with ID {script_id} not found")
+        if not os.path.exists(script.file_path):
+            logger.error(f"Source script not found: {script.file_path}")
+            raise FileNotFoundError(f"Source script not found: {script.file_path}")
+
+        checksum = file_sha256(script.file_path)
+        file_path, file_name = script.file_path, script.file_name
+        rows = db.query(ScriptTarget, Server).join(Server, ScriptTarget.server_id == Server.id).filter(ScriptTarget.id.in_(target_ids)).all()
+        # Transfer threads only get plain values; the session stays on this thread
+        targets = [(target, (server.hostname, server.username, server.key_path, server.port or 22, server.tags)) for target, server in rows]
+        for target, _ in targets:
+            target.upload_status = "Uploading"
         db.commit()
+
+        # Each transfer holds a host slot like any other job on that server. The
+        # bandwidth budgets live in Redis, shared by every publish on every worker.
+        total_limit = ByteRateLimiter(redis_client, "orchkid:bandwidth:publish", settings.PUBLISH_TOTAL_BANDWIDTH) if settings.PUBLISH_TOTAL_BANDWIDTH else None
+
+        def transfer(host):
+            hostname, username, key_path, port, tags = host
+            lease = host_limiter.acquire_wait(
+                hostname, host_limiter.limit_for(tags), settings.PUBLISH_HOST_SLOT_WAIT, settings.HOST_SLOT_RETRY_DELAY,
+            )
+            if lease is None:
+                raise RuntimeError(f"{hostname} stayed at its concurrency limit")
+            limiters = [l for l in (total_limit,) if l]
+            if settings.PUBLISH_HOST_BANDWIDTH:
+                limiters.append(ByteRateLimiter(redis_client, f"orchkid:bandwidth:host:{hostname}", settings.PUBLISH_HOST_BANDWIDTH))
+            with host_limiter.hold(lease):
+                return run_scp_command(
+                    hostname, username, file_path, f"/home/{username}/bin/{file_name}", key_path,
+                    port=port, checksum=checksum, limiters=limiters
+                )
+
+        summary = {"completed": 0, "unchanged": 0, "failed": 0, "bytes_sent": 0, "bytes_saved": 0}
+        with ThreadPoolExecutor(max_workers=settings.PUBLISH_CONCURRENCY, thread_name_prefix="publish") as pool:
+            futures = {pool.submit(transfer, host): target for target, host in targets}
+            for future in as_completed(futures):
+                target = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    target.upload_status = "Failed"
+                    target.error = str(e)
+                    summary["failed"] += 1
+                else:
+                    target.upload_status = "Completed" if result["transferred"] else "Unchanged"
+                    target.checksum = result["checksum"]
+                    target.bytes_sent = result["bytes_sent"]
+                    target.error = None
+                    summary["completed" if result["transferred"] else "unchanged"] += 1
+                    summary["bytes_sent"] += result["bytes_sent"]
+                    summary["bytes_saved"] += result["bytes_saved"]
+                db.commit()
+
+        logger.info(f"Published script ID {script_id}: {summary}")
+        return {"script_id": script_id, **summary}
+
+
+def is_one_time_schedule(sched: ScheduleJob):
+    """Pending one-time schedules fire through a Celery ETA instead of the scheduler loop."""
+    return bool(sched.is_active and sched.one_time_run and not sched.cron_expression and not sched.last_run_at)
+
+
+def prepare_one_time_run(sched: ScheduleJob):
+    """Assign a fresh ETA task id to the schedule before it is committed.
+
+    Returns the previous task id so send_one_time_run can revoke it.
+    """
+    previous = sched.eta_task_id
+    sched.eta_task_id = str(uuid.uuid4()) if is_one_time_schedule(sched) else None
+    return previous
+
+
+def send_one_time_run(sched: ScheduleJob, revoke_task_id: str = None):
+    """Revoke the old ETA task and hand the schedule to Celery; call after commit."""
+    if revoke_task_id and revoke_task_id != sched.eta_task_id:
+        revoke_one_time_run(revoke_task_id)
+    if sched.eta_task_id:
+        eta = as_utc(sched.one_time_run, schedule_timezone(sched.timezone))
+        fire_one_time_schedule.apply_async((sched.id,), task_id=sched.eta_task_id, eta=eta)
+        logger.info(f"One-time schedule {sched.id} handed to Celery for {eta} as task {sched.eta_task_id}")
+
+
+def revoke_one_time_run(task_id: str):
+    # Best effort: workers forget revocations on restart, but a superseded
+    # task no longer matches eta_task_id and skips itself anyway
+    try:
+        celery_app.control.revoke(task_id)
     except Exception as e:
-        logger.error(f"Failed to upload script: {e}", exc_info=True)
-        script.upload_status = "Failed"
-        db.commit()
-        raise e
-    
+        logger.warning(f"Could not revoke one-time run task {task_id}: {e}")
 
-    return {
-        "status": "success",
-        "message": f"Script uploaded from {source} to {destination} on {hostname}"
-    }
\ No newline at end of file
+
+@celery_app.task(name="tasks.fire_one_time_schedule", bind=True, ignore_result=True)
+def fire_one_time_schedule(self, schedule_id: int):
+    # Only the task id currently stored on the schedule may fire it, and only
+    # once: revoked, superseded or redelivered ETA messages are no-ops.
+    with session_scope() as db:
+        sched = db.query(ScheduleJob).filter(ScheduleJob.id == schedule_id).first()
+        if not sched or sched.eta_task_id != self.request.id or not is_one_time_schedule(sched):
+            logger.info(f"Skipping stale one-time run {self.request.id} for schedule {schedule_id}")
+            return {"status": "skipped"}
+
+        planned = as_utc(sched.one_time_run, schedule_timezone(sched.timezone))
+        claimed = db.query(ScheduleJob).filter(
+            ScheduleJob.id == schedule_id,
+            ScheduleJob.eta_task_id == self.request.id,
+            ScheduleJob.last_run_at.is_(None),
+        ).update({ScheduleJob.last_run_at: planned.replace(tzinfo=None)}, synchronize_session=False)
+        if not claimed:
+            db.rollback()
+            return {"status": "skipped"}
+
+        lateness = datetime.now(pytz.UTC) - planned
+        policy = sched.misfire_policy or settings.SCHEDULE_MISFIRE_POLICY
+        if policy == "skip" and lateness > timedelta(seconds=settings.SCHEDULE_MISFIRE_GRACE):
+            db.commit()
+            logger.info(f"One-time schedule {schedule_id} missed by {lateness}, skipped by misfire policy")
+            return {"status": "missed"}
+
+        script, server = db.query(Scripts, Server).join(Server, Scripts.server_id == Server.id).filter(Scripts.id == sched.script_id).one()
+        job = Job(
+            command=f"bash /home/{server.username}/bin/{script.file_name}",
+            hostname=server.hostname,
+            server_id=server.id,
+            key_path=server.key_path,
+            job_id=script.id,
+            username=server.username,
+            command_description=script.description,
+            command_status="queued",
+            runner=script.runner,
+            lane=SCHEDULED_LANE
+        )
+        db.add(job)
+        db.flush()
+        job_id, script_id = job.id, script.id
+        db.commit()
+        enqueue_run(script_id, job_id, SCHEDULED_LANE)
+        scheduler_metrics.record_fire(lateness.total_seconds())
+        logger.info(f"One-time schedule {schedule_id} fired {lateness.total_seconds():.1f}s after {planned} as job {job_id}")
+        return {"status": "fired", "job_id": job_id}